@@ -13,20 +13,29 @@
 # limitations under the License.
 """DataGateway to work with data."""
 
+import copy
+import functools
+import hashlib
+import io
+import json
+import logging
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 from typing import Any, Literal
 from google.auth import credentials
 from google.cloud import bigquery
+from google.cloud import bigquery_storage
 from google.api_core import exceptions, retry
 from google.cloud.bigquery.dataset import Dataset
 #from google.cloud.exceptions import NotFound  # type: ignore
 import pandas as pd
-import pandas_gbq
+import pyarrow as pa
+import cachetools
 import country_converter as coco
-from itertools import groupby
 
 from logger import logger
 from config import Config, ConfigTarget, AppNotInitializedError, InvalidConfigurationError
@@ -35,9 +44,112 @@ from bigquery_utils import CloudBigQueryUtils
 from utils import format_duration
 
 TABLE_USERS_NORMALIZED = 'users_normalized'
+# a table label with a fingerprint of the schema the table was last
+# reconciled with (see `DataGateway._ensure_table`)
+SCHEMA_FINGERPRINT_LABEL = 'schema_fp'
+# max number of failed users to pass as a query parameter instead of
+# loading them into a staging table
+FAILED_USERS_INLINE_THRESHOLD = 10000
+# results with fewer rows are read via REST (setting up a Storage API read
+# session costs more than it saves on small results)
+STORAGE_API_MIN_ROWS = 10000
 
 country_name_to_code_cache = {}
 
+# tables metadata (as returned by get_table) shared by all gateways in
+# the process, keyed by (project, dataset, table)
+_TABLE_META_CACHE = cachetools.TTLCache(maxsize=1024, ttl=300)
+_TABLE_META_LOCK = threading.RLock()
+
+# GA4 stats keyed by (GA4 table, first day, last day)
+_GA4_STATS_CACHE = cachetools.TTLCache(maxsize=64, ttl=600)
+_GA4_STATS_LOCK = threading.RLock()
+
+# audiences logs keyed by
+# (project, dataset, include_duplicates, audience name)
+_AUDIENCES_LOG_CACHE = cachetools.TTLCache(maxsize=32, ttl=60)
+_AUDIENCES_LOG_LOCK = threading.RLock()
+
+# audiences keyed by (project, dataset)
+_AUDIENCES_CACHE = cachetools.TTLCache(maxsize=32, ttl=30)
+_AUDIENCES_LOCK = threading.RLock()
+
+
+def _format_sql_literal(value: Any) -> str:
+  if value is None:
+    return 'NULL'
+  if isinstance(value, str):
+    value = value.replace('\\', '\\\\').replace("'", "\\'").replace(
+        '\n', '\\n')
+    return f"'{value}'"
+  # datetime is a subclass of date, so it's checked first
+  if isinstance(value, datetime):
+    return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+  if isinstance(value, date):
+    return f"DATE '{value.isoformat()}'"
+  return str(value)
+
+
+def _inline_query_parameters(
+    query: str, params: list[bigquery.ScalarQueryParameter |
+                             bigquery.ArrayQueryParameter]) -> str:
+  """Substitute query parameters into a query as literals."""
+  values = {}
+  for param in params:
+    if isinstance(param, bigquery.ArrayQueryParameter):
+      values[param.name] = '[' + ', '.join(
+          _format_sql_literal(v) for v in param.values) + ']'
+    else:
+      values[param.name] = _format_sql_literal(param.value)
+  return re.sub(r'@(\w+)', lambda m: values.get(m.group(1), m.group(0)),
+                query)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_country_converter() -> coco.CountryConverter:
+  """Return a shared CountryConverter (it loads its data on creation)."""
+  return coco.CountryConverter(include_obsolete=False)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_country_codes_by_name() -> dict[str, str]:
+  """Return ISO2 codes by countries short names (from converter's data)."""
+  data = _get_country_converter().data
+  return dict(zip(data['name_short'], data['ISO2']))
+
+
+def _get_table_meta_key(table_ref: bigquery.TableReference) -> tuple[str, ...]:
+  return (table_ref.project, table_ref.dataset_id, table_ref.table_id)
+
+
+def _invalidate_table_meta(table_ref: bigquery.TableReference | None = None):
+  """Remove a table (or all tables if none specified) from metadata cache."""
+  with _TABLE_META_LOCK:
+    if table_ref is None:
+      _TABLE_META_CACHE.clear()
+    else:
+      _TABLE_META_CACHE.pop(_get_table_meta_key(table_ref), None)
+
+
+def _invalidate_audiences_log(project_id: str, bq_dataset_id: str):
+  """Remove cached audiences logs of a dataset."""
+  with _AUDIENCES_LOG_LOCK:
+    for key in list(_AUDIENCES_LOG_CACHE.keys()):
+      if key[:2] == (project_id, bq_dataset_id):
+        _AUDIENCES_LOG_CACHE.pop(key, None)
+
+
+def _invalidate_audiences(project_id: str, bq_dataset_id: str):
+  """Remove cached audiences of a dataset."""
+  with _AUDIENCES_LOCK:
+    _AUDIENCES_CACHE.pop((project_id, bq_dataset_id), None)
+
+
+def _get_schema_fingerprint(schema: list[bigquery.SchemaField]) -> str:
+  """Return a short hash of a table schema (suitable for a label value)."""
+  fields = [(f.name, f.field_type, f.mode) for f in schema]
+  return hashlib.md5(repr(fields).encode()).hexdigest()[:16]
+
 
 class QueryExecutionError(Exception):
 
@@ -46,6 +158,16 @@ class QueryExecutionError(Exception):
     self.query = query
 
 
+@functools.lru_cache(maxsize=16)
+def _read_template(filename: str) -> str:
+  """Read a SQL template shipped alongside the module (cached per process)."""
+  script_path = os.path.realpath(__file__)
+  script_dir = os.path.dirname(script_path)
+  filename = os.path.join(script_dir, filename)
+  with open(filename) as f:
+    query = f.read()
+  return query
+
 class TableSchemas:
   """Container for DB tables schemas"""
   audiences = [
@@ -102,6 +224,15 @@ class TableSchemas:
       bigquery.SchemaField(
           name='total_control_user_count', field_type='INT64', mode='REQUIRED'),
   ]
+  # audiences_log is partitioned by day, so reads of recent history are pruned
+  # (applied only when the table is (re)created)
+  audiences_log_partitioning = bigquery.TimePartitioning(
+      type_=bigquery.TimePartitioningType.DAY, field='date')
+  # and clustered by audience name, as all per-audience reads filter by it
+  audiences_log_clustering = ['name']
+  uploaded_users = [
+      bigquery.SchemaField(name='user', field_type='STRING'),
+  ]
   daily_test_users = [
       bigquery.SchemaField(name='user', field_type='STRING'),
       bigquery.SchemaField(name='status', field_type='INT64'),
@@ -162,6 +293,26 @@ class DataGateway:
     self.bq_client.default_project = config.project_id
     self.bq_utils = CloudBigQueryUtils(self.bq_client)
     self.credentials = creds
+    self._bq_storage_client: bigquery_storage.BigQueryReadClient | None = None
+    # (dataset, audience table, group) -> segment tables names
+    self._segment_tables_cache: dict[tuple, tuple[str, ...]] = {}
+
+  @property
+  def bq_storage_client(self) -> bigquery_storage.BigQueryReadClient:
+    """BigQuery Storage API client (created on first use)."""
+    if self._bq_storage_client is None:
+      self._bq_storage_client = bigquery_storage.BigQueryReadClient(
+          credentials=self.credentials)
+    return self._bq_storage_client
+
+  def _get_storage_client_for(
+      self, results: bigquery.table.RowIterator
+  ) -> bigquery_storage.BigQueryReadClient | None:
+    """Return Storage API client if results are large enough to use it."""
+    total_rows = results.total_rows
+    if total_rows is not None and total_rows < STORAGE_API_MIN_ROWS:
+      return None
+    return self.bq_storage_client
 
   def _recreate_dataset(self,
                         dataset_id,
@@ -192,15 +343,23 @@ class DataGateway:
                                        datetime.now().strftime('%Y%m%d_%H%M'))
           ds_backup.location = ds.location
           ds_backup = self.bq_client.create_dataset(ds_backup, True)
-          i = 0
-          for t in self.bq_client.list_tables(ds):
-            self.bq_client.copy_table(
-                ds.dataset_id + '.' + t.table_id,
-                ds_backup.dataset_id + '.' + t.table_id,
-                location=ds.location)
-            i += 1
-          logger.debug('{i} tables were copied to %s', ds_backup.dataset_id)
+          # submit all copy jobs first and only then wait for them
+          # (the dataset must not be deleted before they complete)
+          jobs = [
+              self.bq_client.copy_table(
+                  ds.dataset_id + '.' + t.table_id,
+                  ds_backup.dataset_id + '.' + t.table_id,
+                  location=ds.location)
+              for t in self.bq_client.list_tables(ds, page_size=1000)
+          ]
+          with ThreadPoolExecutor(max_workers=10) as executor:
+            list(executor.map(lambda job: job.result(), jobs))
+          logger.debug('%s tables were copied to %s', len(jobs),
+                       ds_backup.dataset_id)
         self.bq_client.delete_dataset(ds, True)
+        _invalidate_table_meta()
+        _invalidate_audiences_log(self.config.project_id, dataset_id)
+        _invalidate_audiences(self.config.project_id, dataset_id)
         logger.debug('Dataset %s deleted', ds.dataset_id)
         to_create = True
       else:
@@ -223,10 +382,15 @@ class DataGateway:
   def initialize(self, target: ConfigTarget):
     bq_dataset_id = target.bq_dataset_id
     bq_dataset_location = target.bq_dataset_location
-    self.bq_client = bigquery.Client(
-        project=self.config.project_id,
-        credentials=self.credentials,
-        location=bq_dataset_location)
+    if self.bq_client.location != bq_dataset_location:
+      # the client created in __init__ is reused unless the target's dataset
+      # lives in another location (the default one for new jobs)
+      self.bq_client = bigquery.Client(
+          project=self.config.project_id,
+          credentials=self.credentials,
+          location=bq_dataset_location)
+      self.bq_client.default_project = self.config.project_id
+      self.bq_utils = CloudBigQueryUtils(self.bq_client)
 
     self._recreate_dataset(bq_dataset_id, bq_dataset_location, True)
 
@@ -234,7 +398,9 @@ class DataGateway:
     self._ensure_table(table_name, TableSchemas.audiences)
 
     table_name = f'{bq_dataset_id}.audiences_log'
-    self._ensure_table(table_name, TableSchemas.audiences_log)
+    self._ensure_table(table_name, TableSchemas.audiences_log,
+                       TableSchemas.audiences_log_partitioning,
+                       TableSchemas.audiences_log_clustering)
 
     # NOTE: when we change schema for test/control tables
     # we have to update them in all installations.
@@ -264,17 +430,16 @@ class DataGateway:
   FROM {target.bq_dataset_id}.INFORMATION_SCHEMA.TABLES
   WHERE table_name like '{TABLE_USERS_NORMALIZED}_%' ORDER BY 1 DESC
       """
-      response = self.execute_query(query)
-      tables = [r['table_name'] for r in response]
-      # first drop all existing tables users_normalized_*
-      for table in tables:
-        query = f'DROP TABLE IF EXISTS `{target.bq_dataset_id}.{table}`'
-        self.execute_query(query)
-      # drop the view users_normalized if it exists
-      query = (
-          f'DROP VIEW IF EXISTS {target.bq_dataset_id}.{TABLE_USERS_NORMALIZED}'
-      )
-      self.execute_query(query)
+      tables = self.execute_query_arrow(query).column('table_name').to_pylist()
+      # drop all existing tables users_normalized_* and then
+      # the view users_normalized if it exists (as one script job)
+      statements = [
+          f'DROP TABLE IF EXISTS `{target.bq_dataset_id}.{table}`;'
+          for table in tables
+      ]
+      view_name = f'{target.bq_dataset_id}.{TABLE_USERS_NORMALIZED}'
+      statements.append(f'DROP VIEW IF EXISTS {view_name};')
+      self.execute_query('\n'.join(statements))
     else:
       # initialization in default mode from old schema (pre v3)
       # when users_normalized was a single table
@@ -312,24 +477,38 @@ class DataGateway:
       # it won't go into effect as we're not recreating the table and
       # don't know for what period it was created originally.
 
-  def _ensure_table(self, table_name,
-                    expected_schema: list[bigquery.SchemaField]):
+  def _ensure_table(
+      self,
+      table_name,
+      expected_schema: list[bigquery.SchemaField],
+      time_partitioning: bigquery.TimePartitioning | None = None,
+      clustering_fields: list[str] | None = None):
     table_ref = bigquery.TableReference.from_string(table_name,
                                                     self.config.project_id)
+    expected_fp = _get_schema_fingerprint(expected_schema)
     try:
-      table = self.bq_client.get_table(table_ref)
+      table = self._get_table_cached(table_ref)
       logger.debug('Initialize: table %s found', table_name)
+      if clustering_fields and table.clustering_fields != clustering_fields:
+        # unlike partitioning, clustering can be changed in place
+        # (it applies to newly written data)
+        _invalidate_table_meta(table_ref)
+        table.clustering_fields = clustering_fields
+        table = self.bq_client.update_table(table, ['clustering_fields'])
+      if (table.labels or {}).get(SCHEMA_FINGERPRINT_LABEL) == expected_fp:
+        logger.debug('Table %s has compatible schema (fingerprint matched)',
+                     table_name)
+        return
+      # the table is going to be modified (or recreated)
+      _invalidate_table_meta(table_ref)
 
       current_schema = table.schema
+      current_by_name = {field.name: field for field in current_schema}
+      expected_names = {field.name for field in expected_schema}
       added_fields: list[bigquery.SchemaField] = []
       updated_fields: list[bigquery.SchemaField] = []
       for expected_field in expected_schema:
-        current_field = None
-        for field in current_schema:
-          if field.name == expected_field.name:
-            current_field = field
-            break
-
+        current_field = current_by_name.get(expected_field.name)
         expected_field_type = expected_field.field_type
         if expected_field_type == 'INT64':
           expected_field_type = 'INTEGER'
@@ -339,50 +518,67 @@ class DataGateway:
               expected_field.mode != current_field.mode):
           updated_fields.append(expected_field)
 
-      deleted_fields = []
-      for current_field in current_schema:
-        if not any(
-            field.name == current_field.name for field in expected_schema):
-          deleted_fields.append(current_field)
+      deleted_fields = [
+          field for field in current_schema if field.name not in expected_names
+      ]
 
       if deleted_fields:
         # drop columns (update_table doesn't support removing columns)
         logger.debug('Removing excess columns for %s: %s', table_name,
                      deleted_fields)
-        for field in deleted_fields:
-          sql = f'ALTER TABLE `{table_name}` DROP COLUMN {field.name}'
-          self.execute_query(sql)
-        # refresh the table reference, otherwise we'll get:
-        #  'PRECONDITION_FAILED: 412' error on update_table
-        table = self.bq_client.get_table(table_ref)
+        drops = ', '.join(
+            f'DROP COLUMN {field.name}' for field in deleted_fields)
+        sql = f'ALTER TABLE `{table_name}` {drops}'
+        self.execute_query(sql)
+        if not added_fields:
+          # refresh the table reference, otherwise we'll get:
+          #  'PRECONDITION_FAILED: 412' error on update_table
+          # (if columns are added it's refreshed after that anyway)
+          table = self.bq_client.get_table(table_ref)
       if added_fields:
         logger.debug('Adding new columns to %s: %s', table_name, added_fields)
+        # all columns are added in one statement (one job)
+        adds = ',\n  '.join(f'ADD COLUMN {field.name} {field.field_type}'
+                             for field in added_fields)
+        sql = f"""ALTER TABLE `{table_name}`
+  {adds}"""
+        self.execute_query(sql)
+        defaults: list[tuple[str, Any]] = []
         for field in added_fields:
-          sql = f"""ALTER TABLE `{table_name}`
-  ADD COLUMN {field.name} {field.field_type}"""
-          self.execute_query(sql)
           if field.default_value_expression:
             if isinstance(field.default_value_expression, (str)):
               default_value_expression = f"'{field.default_value_expression}'"
             else:
               default_value_expression = field.default_value_expression
-            # 1. ALTER TABLE my_table ADD COLUMN field;
-            # 2. ALTER TABLE my_table ALTER COLUMN field SET DEFAULT '';
-            # 3. UPDATE my_table SET field = '' WHERE TRUE;
-            sql = f"""ALTER TABLE `{table_name}`
-  ALTER COLUMN {field.name} SET DEFAULT {default_value_expression}"""
-            self.execute_query(sql)
-            sql = f"""UPDATE `{table_name}`
-  SET {field.name} = {default_value_expression} WHERE TRUE"""
-            self.execute_query(sql)
+            defaults.append((field.name, default_value_expression))
+        if defaults:
+          # 1. ALTER TABLE my_table ADD COLUMN field; (done above)
+          # 2. ALTER TABLE my_table ALTER COLUMN field SET DEFAULT '';
+          # 3. UPDATE my_table SET field = '' WHERE TRUE;
+          # (steps 2 and 3 are done for all new columns at once,
+          # so the table is rewritten only once)
+          set_defaults = ',\n  '.join(
+              f'ALTER COLUMN {name} SET DEFAULT {value}'
+              for name, value in defaults)
+          sql = f"""ALTER TABLE `{table_name}`
+  {set_defaults}"""
+          self.execute_query(sql)
+          assignments = ', '.join(
+              f'{name} = {value}' for name, value in defaults)
+          sql = f"""UPDATE `{table_name}`
+  SET {assignments} WHERE TRUE"""
+          self.execute_query(sql)
         table = self.bq_client.get_table(table_ref)
 
+      table.labels = {
+          **(table.labels or {}), SCHEMA_FINGERPRINT_LABEL: expected_fp
+      }
       if updated_fields:
         table.schema = expected_schema
         try:
           logger.debug('Updating table %s with new schema:\n %s', table_name,
                        updated_fields)
-          table = self.bq_client.update_table(table, ['schema'])
+          table = self.bq_client.update_table(table, ['schema', 'labels'])
           logger.info('Table %s schema updated', table_name)
         except Exception as e:
           logger.error(e)
@@ -408,6 +604,9 @@ class DataGateway:
                     table.full_table_id, e1)
               self.bq_client.delete_table(table, not_found_ok=True)
               table = bigquery.Table(table_ref, schema=expected_schema)
+              table.time_partitioning = time_partitioning
+              table.clustering_fields = clustering_fields
+              table.labels = {SCHEMA_FINGERPRINT_LABEL: expected_fp}
               self.bq_client.create_table(table)
               return
           logger.warning('The error is not a scheme_incompatible error '
@@ -415,55 +614,147 @@ class DataGateway:
           raise
       else:
         logger.debug('Table %s has compatible schema', table_name)
+        # remember the schema is compatible so next time we can skip comparing
+        self.bq_client.update_table(table, ['labels'])
     except exceptions.NotFound:
       logger.debug("Initialize: Creating '%s' table", table_name)
       table = bigquery.Table(table_ref, schema=expected_schema)
+      table.time_partitioning = time_partitioning
+      table.clustering_fields = clustering_fields
+      table.labels = {SCHEMA_FINGERPRINT_LABEL: expected_fp}
       self.bq_client.create_table(table)
 
-  def execute_query(
+  def _get_table_cached(
+      self, table_ref: bigquery.TableReference) -> bigquery.Table:
+    """Return table's metadata (via get_table) cached for a few minutes.
+
+    Callers must not modify the returned object without invalidating
+    the cache entry first (see `_invalidate_table_meta`).
+    """
+    key = _get_table_meta_key(table_ref)
+    with _TABLE_META_LOCK:
+      table = _TABLE_META_CACHE.get(key)
+    if table is None:
+      table = self.bq_client.get_table(table_ref)
+      with _TABLE_META_LOCK:
+        _TABLE_META_CACHE[key] = table
+    return table
+
+  def _query_to_arrow_batches(
       self,
       query: str,
-      return_stat=False) -> list[dict] | tuple[list[dict], float, int]:
-    """Execute a query.
+      job_config: bigquery.QueryJobConfig | None = None):
+    """Execute a query and iterate over its results as Arrow record batches.
+
+    Unlike `execute_query` it doesn't materialize rows as dicts, results are
+    streamed via BigQuery Storage Read API.
 
       Args:
         query: a SQL query to execute
+        job_config: an optional job config (e.g. with query parameters)
+
+      Returns:
+        an iterator of pyarrow.RecordBatch
+    """
+    query_job = self._submit_query(query, job_config)
+    try:
+      results = query_job.result()
+    except exceptions.BadRequest as e:
+      raise self._get_query_error(e, query_job.query) from e
+    return results.to_arrow_iterable(
+        bqstorage_client=self._get_storage_client_for(results))
+
+  def execute_query_arrow(
+      self,
+      query: str,
+      job_config: bigquery.QueryJobConfig | None = None) -> pa.Table:
+    """Execute a query and fetch its results as an Arrow table.
+
+    Results are read via BigQuery Storage Read API, it's preferable over
+    `execute_query` for large results.
+
+      Args:
+        query: a SQL query to execute
+        job_config: an optional job config (e.g. with query parameters)
+
+      Returns:
+        results as pyarrow.Table
+    """
+    query_job = self._submit_query(query, job_config)
+    try:
+      results = query_job.result()
+    except exceptions.BadRequest as e:
+      raise self._get_query_error(e, query_job.query) from e
+    return results.to_arrow(
+        bqstorage_client=self._get_storage_client_for(results),
+        create_bqstorage_client=False)
+
+  def _submit_query(
+      self,
+      query: str,
+      job_config: bigquery.QueryJobConfig | None = None) -> bigquery.QueryJob:
+    """Start a query job without waiting for its results.
+
+      Args:
+        query: a SQL query to execute
+        job_config: an optional job config (e.g. with query parameters)
+
+      Returns:
+        a started query job (see `_collect`)
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+      # numbering lines is not free, so do it only if it's going to be logged
+      query_logged = '\n'.join(
+          f'{i}: {line.rstrip()}'
+          for i, line in enumerate(query.strip().split('\n'), start=1))
+      logger.debug('Executing SQL query: \n%s', query_logged)
+    try:
+      return self.bq_client.query(query, job_config=job_config)
+    except exceptions.BadRequest as e:
+      raise self._get_query_error(e, query) from e
+
+  def _get_query_error(self, e: exceptions.BadRequest,
+                       query: str) -> Exception:
+    if e.errors and e.errors[0]['reason'] == 'invalidQuery' and e.errors[0][
+        'message'].startswith('Unrecognized name:'):
+      return AppNotInitializedError(
+          'Query failed to execute due to either mistake in the query'
+          f' or schema incompatibility. {e.errors[0]["message"]}.'
+          ' Please re-initialize application')
+    return QueryExecutionError(
+        'Query execution error:' +
+        e.errors[0]['message'] if e.errors else str(e), query)
+
+  def _collect(
+      self,
+      query_job: bigquery.QueryJob,
+      return_stat=False) -> list[dict] | tuple[list[dict], float, int]:
+    """Wait for a query job started by `_submit_query` and fetch its results.
+
+      Args:
+        query_job: a query job
         return_stat: if true then function returns a tuple
 
       Returns:
         results or tuple with results, cost, number of billed bytes
     """
     ts_start = datetime.now()
-    lines = [
-        f'{i}: {line.rstrip()}'
-        for i, line in enumerate(query.strip().split('\n'), start=1)
-    ]
-    query_logged = '\n'.join(lines)
-    logger.debug('Executing SQL query: \n%s', query_logged)
     try:
-      query_job = self.bq_client.query(query)
       results = query_job.result()
       # current pricing for on-demand model (2024): $6.25 per TiB
       cost = 6.25 * query_job.total_bytes_billed / 1024**4
     except exceptions.BadRequest as e:
-      if e.errors and e.errors[0]['reason'] == 'invalidQuery' and e.errors[0][
-          'message'].startswith('Unrecognized name:'):
-        raise AppNotInitializedError(
-            'Query failed to execute due to either mistake in the query'
-            f' or schema incompatibility. {e.errors[0]["message"]}.'
-            ' Please re-initialize application') from e
-      raise QueryExecutionError(
-          'Query execution error:' +
-          e.errors[0]['message'] if e.errors else str(e), query) from e
-
-    fields = [field.name for field in results.schema]
-    data_list = []
-
-    for row in results:
-      row_dict = {}
-      for i, value in enumerate(row):
-        row_dict[fields[i]] = value
-      data_list.append(row_dict)
+      raise self._get_query_error(e, query_job.query) from e
+
+    if query_job.statement_type in ('SELECT', 'SCRIPT'):
+      # rows are decoded from Arrow (via Storage Read API for large results)
+      # instead of one by one from REST pages
+      data_list = results.to_arrow(
+          bqstorage_client=self._get_storage_client_for(results),
+          create_bqstorage_client=False).to_pylist()
+    else:
+      # DDL/DML statements have no rows to fetch
+      data_list = []
 
     elapsed = datetime.now() - ts_start
     logger.debug(
@@ -475,6 +766,24 @@ class DataGateway:
 
     return data_list
 
+  def execute_query(
+      self,
+      query: str,
+      return_stat=False,
+      job_config: bigquery.QueryJobConfig | None = None
+  ) -> list[dict] | tuple[list[dict], float, int]:
+    """Execute a query.
+
+      Args:
+        query: a SQL query to execute
+        return_stat: if true then function returns a tuple
+        job_config: an optional job config (e.g. with query parameters)
+
+      Returns:
+        results or tuple with results, cost, number of billed bytes
+    """
+    return self._collect(self._submit_query(query, job_config), return_stat)
+
   def get_ga4_table_name(self, target: ConfigTarget, wildcard=False):
     ga_fqn = f'{target.ga4_project}.{target.ga4_dataset}.{target.ga4_table}'
     if wildcard and ga_fqn[-2:] != '_*':
@@ -482,16 +791,23 @@ class DataGateway:
     return ga_fqn
 
   def check_ga4(self, ga4_project: str, ga4_dataset: str, ga4_table='events'):
+    # the dataset is expected to have a table for the day before yesterday
+    yesterday = (date.today() - timedelta(days=2)).strftime('%Y%m%d')
+    expected_table = ga4_table + '_' + yesterday
+    # check the table presence in BigQuery, so at most one row is returned
     query = f"""SELECT table_name
   FROM `{ga4_project}.{ga4_dataset}.INFORMATION_SCHEMA.TABLES`
-  WHERE table_name LIKE '{ga4_table}_%'
-  ORDER BY 1 DESC"""
+  WHERE table_name = @expected_table"""
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('expected_table', 'STRING',
+                                      expected_table)
+    ])
     try:
       # TODO: if the target config has't been configured then we don't have a BQ
       # location so we don't know where execute the query,
       # by default it'll use US location
-      response = self.execute_query(query)
-      tables = [r['table_name'] for r in response]
+      tables = self.execute_query_arrow(
+          query, job_config).column('table_name').to_pylist()
     except BaseException as e:
       logger.error(e)
       sa = f'{self.config.project_id}@appspot.gserviceaccount.com'
@@ -501,17 +817,12 @@ class DataGateway:
           f'({ga4_project}.{ga4_dataset}.{ga4_table}).\n'
           f'Original error: {e}') from e
 
-    if logger.isEnabledFor(logger.level):
-      logger.debug('Found GA4 events tables: %s', tables)
-    yesterday = (date.today() - timedelta(days=2)).strftime('%Y%m%d')
-    # first row should be 'events_intraday_yyymmdd' (for today),
-    # and previous one 'events_yyyymmdd' for tomorrow
-    found = next((t for t in tables if t == ga4_table + '_' + yesterday), None)
-    if not found:
+    logger.debug('Found GA4 events tables: %s', tables)
+    if not tables:
       raise InvalidConfigurationError(
           f'The specified GA4 dataset ({ga4_project}.{ga4_dataset}) does exist '
           "but does not seem to be updated as we couldn't find an events table"
-          f" for the day before yesterday ('{ga4_table + '_' + yesterday}')")
+          f" for the day before yesterday ('{expected_table}')")
 
     return tables
 
@@ -521,45 +832,38 @@ class DataGateway:
       raise ValueError('days_ago_start should be greater than days_ago_end')
 
     ga_table = self.get_ga4_table_name(target, True)
+    today = date.today()
+    day_start = (today - timedelta(days=int(days_ago_start))).strftime('%Y%m%d')
+    day_end = (today - timedelta(days=int(days_ago_end))).strftime('%Y%m%d')
+    cache_key = (ga_table, day_start, day_end)
+    with _GA4_STATS_LOCK:
+      result = _GA4_STATS_CACHE.get(cache_key)
+    if result is not None:
+      logger.debug('Using cached GA4 stats for target %s (GA4 table %s)',
+                   target.name, ga_table)
+      # callers can modify the stats, so the cached value isn't shared
+      return copy.deepcopy(result)
     logger.debug('Loading GA4 stats for target %s (GA4 table %s)', target.name,
                  ga_table)
-    # load events stats
+    # with parameters (instead of literals and CURRENT_DATE) the query text
+    # stays the same and BigQuery can reuse cached results
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter('day_start', 'STRING', day_start),
+            bigquery.ScalarQueryParameter('day_end', 'STRING', day_end),
+        ],
+        use_query_cache=True)
+    # events and countries stats are computed in one scan of the events table
+    # via grouping sets ((app_id, event) and (app_id, country))
     query = f"""
 SELECT
   app_info.id AS app_id,
-  event_name as event,
-  count(1) as count
-FROM
-  `{ga_table}`
-WHERE
-    app_info.id IS NOT NULL
-    AND device.operating_system = 'Android'
-    AND device.advertising_id IS NOT NULL
-    AND device.advertising_id NOT IN ('', '00000000-0000-0000-0000-000000000000')
-    AND _TABLE_SUFFIX BETWEEN
-      format_date('%Y%m%d', date_sub(CURRENT_DATE(), INTERVAL {str(int(days_ago_start))} DAY))
-      AND
-      format_date('%Y%m%d', date_sub(CURRENT_DATE(), INTERVAL {str(int(days_ago_end))} DAY))
-GROUP BY app_info.id, event_name
-ORDER BY 1, 3 DESC
-"""
-    events_stat = self.execute_query(query)
-    #pprint(events_stat)
-    logger.debug('Loaded event stats per app_id: %s', len(events_stat))
-    app_ids = set()
-    events_stat_dict = {}
-    for app_id, group in groupby(
-        sorted(events_stat, key=lambda x: x['app_id']),
-        key=lambda x: x['app_id']):
-      events_stat_dict[app_id] = list(group)
-      app_ids.add(app_id)
-
-    query = f"""
-SELECT
-  app_info.id as app_id,
+  event_name AS event,
   geo.country AS country,
-  '' AS country_code,
-  count(DISTINCT device.advertising_id) as count
+  GROUPING(event_name) = 0 AS is_event,
+  IF(GROUPING(event_name) = 0,
+     COUNT(1),
+     COUNT(DISTINCT device.advertising_id)) AS count
 FROM
   `{ga_table}`
 WHERE
@@ -567,44 +871,70 @@ WHERE
     AND device.operating_system = 'Android'
     AND device.advertising_id IS NOT NULL
     AND device.advertising_id NOT IN ('', '00000000-0000-0000-0000-000000000000')
-    AND _TABLE_SUFFIX BETWEEN
-      format_date('%Y%m%d', date_sub(CURRENT_DATE(), INTERVAL {str(int(days_ago_start))} DAY))
-      AND
-      format_date('%Y%m%d', date_sub(CURRENT_DATE(), INTERVAL {str(int(days_ago_end))} DAY))
-GROUP BY app_info.id, geo.country
-HAVING country is not null AND country != ''
-ORDER BY 1, 3 DESC
+    AND _TABLE_SUFFIX BETWEEN @day_start AND @day_end
+GROUP BY GROUPING SETS ((app_info.id, event_name), (app_info.id, geo.country))
+HAVING is_event OR (country IS NOT NULL AND country != '')
+ORDER BY app_id, count DESC
 """
-    countries_stat = self.execute_query(query)
-    logger.debug('Loaded country stats per app_id: %s', len(countries_stat))
+    rows = self.execute_query(query, job_config=job_config)
+    # rows are already ordered by app_id, so the dict keys will be ordered too
+    events_stat_dict = {}
+    countries_stat = []
+    for row in rows:
+      if row['is_event']:
+        events_stat_dict.setdefault(row['app_id'], []).append({
+            'app_id': row['app_id'],
+            'event': row['event'],
+            'count': row['count']
+        })
+      else:
+        countries_stat.append({
+            'app_id': row['app_id'],
+            'country': row['country'],
+            'country_code': '',
+            'count': row['count']
+        })
+    logger.debug('Loaded event stats per app_id: %s, country stats: %s',
+                 len(events_stat_dict), len(countries_stat))
 
     countries_stat_dict = {}
     ts_start = datetime.now()
-    for app_id, group in groupby(
-        sorted(countries_stat, key=lambda x: x['app_id']),
-        key=lambda x: x['app_id']):
-      countries = list(group)
-      for country in countries:
-        country_name = country['country']
-        code = country_name_to_code_cache.get(country_name, None)
-        if not code:
-          code = coco.convert(
-              names=[country['country']], to='ISO2', not_found=None)
-          country_name_to_code_cache[country_name] = code
-        country['country_code'] = code
-        if code == country['country']:
-          logger.warning('Could not find country by its name %s',
-                         country['country'])
-      countries_stat_dict[app_id] = countries
+    # exact short names are resolved with a dict lookup, others (e.g. names
+    # variants) are converted at once (coco.convert is expensive)
+    codes_by_name = _get_country_codes_by_name()
+    names = []
+    for name in {country['country'] for country in countries_stat}:
+      if name in country_name_to_code_cache:
+        continue
+      if name in codes_by_name:
+        country_name_to_code_cache[name] = codes_by_name[name]
+      else:
+        names.append(name)
+    if names:
+      codes = _get_country_converter().convert(
+          names=names, to='ISO2', not_found=None)
+      if not isinstance(codes, list):
+        codes = [codes]
+      country_name_to_code_cache.update(zip(names, codes))
+      not_found = [name for name, code in zip(names, codes) if code == name]
+      if not_found:
+        logger.warning('Could not find countries by their names: %s',
+                       not_found)
+    for country in countries_stat:
+      country['country_code'] = country_name_to_code_cache[country['country']]
+      countries_stat_dict.setdefault(country['app_id'], []).append(country)
     elapsed = datetime.now() - ts_start
     logger.debug('Enriched stats by country with country codes (elapsed %s)',
                  elapsed)
 
-    return {
-        'app_ids': sorted(list(app_ids)),
+    result = {
+        'app_ids': list(events_stat_dict.keys()),
         'events': events_stat_dict,
         'countries': countries_stat_dict
     }
+    with _GA4_STATS_LOCK:
+      _GA4_STATS_CACHE[cache_key] = result
+    return copy.deepcopy(result)
 
   def _get_ga4_last_table(self, target: ConfigTarget) -> str | None:
     """Return name of last events table in GA4 dataset (events_yyyymmdd)."""
@@ -613,12 +943,18 @@ ORDER BY 1, 3 DESC
     ga4_table = target.ga4_table
     query = f"""SELECT table_name
   FROM `{ga4_project}.{ga4_dataset}.INFORMATION_SCHEMA.TABLES`
-  WHERE table_name LIKE '{ga4_table}_%'
-    AND table_name NOT LIKE '{ga4_table}_intraday_%'
+  WHERE table_name LIKE @table_pattern
+    AND table_name NOT LIKE @intraday_table_pattern
   ORDER BY 1 DESC
   LIMIT 1"""
-    response = self.execute_query(query)
-    tables = [r['table_name'] for r in response]
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('table_pattern', 'STRING',
+                                      f'{ga4_table}_%'),
+        bigquery.ScalarQueryParameter('intraday_table_pattern', 'STRING',
+                                      f'{ga4_table}_intraday_%'),
+    ])
+    tables = self.execute_query_arrow(
+        query, job_config).column('table_name').to_pylist()
     if not tables:
       return None
     return tables[0]
@@ -626,7 +962,25 @@ ORDER BY 1, 3 DESC
   def get_audiences(self,
                     target: ConfigTarget,
                     audience_name: str = None) -> list[Audience]:
-    condition = f"WHERE name='{audience_name}'" if audience_name else ''
+    if audience_name:
+      return self._load_audiences(target, audience_name)
+    # the whole list is cached for a short time unless it's updated
+    cache_key = (self.config.project_id, target.bq_dataset_id)
+    with _AUDIENCES_LOCK:
+      audiences = _AUDIENCES_CACHE.get(cache_key)
+    if audiences is None:
+      audiences = self._load_audiences(target, None)
+      with _AUDIENCES_LOCK:
+        _AUDIENCES_CACHE[cache_key] = audiences
+    # callers modify audiences (e.g. mode or user_list), so return copies
+    return copy.deepcopy(audiences)
+
+  def _load_audiences(self, target: ConfigTarget,
+                      audience_name: str | None) -> list[Audience]:
+    condition = 'WHERE name = @name' if audience_name else ''
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('name', 'STRING', audience_name)
+    ]) if audience_name else None
     query = f"""
 SELECT
   name, app_id, table_name, countries, events_include, events_exclude, days_ago_start, days_ago_end, user_list, created, mode, query, ttl, split_ratio
@@ -634,56 +988,34 @@ FROM `{target.bq_dataset_id}.audiences`
 {condition}
 ORDER BY created
 """
-    rows = self.execute_query(query)
-    audiences = []
-    for row in rows:
-      audience = Audience()
-      audience.name = row['name']
-      audience.app_id = row['app_id']
-      audience.table_name = row['table_name']
-      audience.countries = row['countries']
-      audience.events_include = row['events_include']
-      audience.events_exclude = row['events_exclude']
-      audience.days_ago_start = row['days_ago_start']
-      audience.days_ago_end = row['days_ago_end']
-      audience.user_list = row['user_list']
-      audience.created = row['created']
-      audience.mode = row['mode']
-      audience.query = row['query']
-      audience.ttl = row['ttl']
-      audience.split_ratio = row['split_ratio']
-      audiences.append(audience)
-    return audiences
+    # rows are decoded from Arrow and mapped onto audiences as dicts
+    rows = self.execute_query_arrow(query, job_config).to_pylist()
+    return [Audience.from_dict(row) for row in rows]
 
   def update_audiences(self, target: ConfigTarget, audiences: list[Audience]):
     table_name = f'{target.bq_dataset_id}.audiences'
     audiences = audiences or []
     audiences_old = self.get_audiences(target)
-    logger.debug('Current audiences:')
-    logger.debug(audiences_old)
+    logger.debug('Current audiences: %s', audiences_old)
     to_remove: list[Audience] = []
     to_create: list[Audience] = []
     to_update: list[Audience] = []
 
+    old_by_name = {old.name: old for old in audiences_old}
+    new_by_name = {new.name: new for new in audiences}
     for new in audiences:
-      name = new.name
-      old = next((old for old in audiences_old if old.name == name), None)
-      if old:
+      if new.name in old_by_name:
         to_update.append(new)
       else:
         to_create.append(new)
 
     for old in audiences_old:
-      new = next((new for new in audiences if new.name == old.name), None)
-      if new is None:
+      if old.name not in new_by_name:
         to_remove.append(old)
 
-    logger.debug('audiences to create: ')
-    logger.debug(to_create)
-    logger.debug('audiences to update: ')
-    logger.debug(to_update)
-    logger.debug('audiences to remove: ')
-    logger.debug(to_remove)
+    logger.debug('audiences to create: %s', to_create)
+    logger.debug('audiences to update: %s', to_update)
+    logger.debug('audiences to remove: %s', to_remove)
 
     for i in to_create + to_update:
       name = i.name
@@ -692,30 +1024,37 @@ ORDER BY created
       if not i.ttl:
         i.ttl = 1
 
-    selects = []
-    query_params = []
-    idx = 0
-    for i in to_create + to_update:
-      idx += 1
-      query_params.append(
-          bigquery.ScalarQueryParameter('query' + str(idx), 'STRING', i.query))
-      selects.append(f"""SELECT '{i.name}' name, '{i.app_id}' app_id,
-  {"'" + i.table_name + "'"} table_name,
-  {i.countries} countries,
-  {i.events_include} events_include, {i.events_exclude} events_exclude,
-  {i.days_ago_start} days_ago_start, {i.days_ago_end} days_ago_end,
-  {"'" + i.user_list + "'" if i.user_list is not None else "CAST(NULL as STRING)"} user_list,
-  {"'" + i.mode + "'"} mode,
-  @query{idx} query,
-  {i.ttl} ttl,
-  {"NULL" if not i.split_ratio else i.split_ratio} split_ratio
-""")
-    sql_selects = '\nUNION ALL\n'.join(selects)
-    query = f"""
+    rows = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter('name', 'STRING', i.name),
+            bigquery.ScalarQueryParameter('app_id', 'STRING', i.app_id),
+            bigquery.ScalarQueryParameter('table_name', 'STRING',
+                                          i.table_name),
+            bigquery.ArrayQueryParameter('countries', 'STRING',
+                                         i.countries or []),
+            bigquery.ArrayQueryParameter('events_include', 'STRING',
+                                         i.events_include or []),
+            bigquery.ArrayQueryParameter('events_exclude', 'STRING',
+                                         i.events_exclude or []),
+            bigquery.ScalarQueryParameter('days_ago_start', 'INT64',
+                                          i.days_ago_start),
+            bigquery.ScalarQueryParameter('days_ago_end', 'INT64',
+                                          i.days_ago_end),
+            bigquery.ScalarQueryParameter('user_list', 'STRING', i.user_list),
+            bigquery.ScalarQueryParameter('mode', 'STRING', i.mode),
+            bigquery.ScalarQueryParameter('query', 'STRING', i.query),
+            bigquery.ScalarQueryParameter('ttl', 'INT64', i.ttl),
+            bigquery.ScalarQueryParameter('split_ratio', 'FLOAT64',
+                                          i.split_ratio or None),
+        ) for i in to_create + to_update
+    ]
+    if rows:
+      # all audiences are passed as one ARRAY<STRUCT> parameter,
+      # so the statement text doesn't depend on the number of audiences
+      query = f"""
 MERGE `{table_name}` t
-USING (
-{sql_selects}
-) s
+USING UNNEST(@rows) s
 ON t.name = s.name
 WHEN MATCHED THEN
   UPDATE SET t.app_id = s.app_id,
@@ -736,52 +1075,65 @@ WHEN NOT MATCHED THEN
   INSERT (name, app_id, table_name, countries, events_include, events_exclude, days_ago_start, days_ago_end, created, mode, query, ttl, split_ratio)
   VALUES (s.name, s.app_id, s.table_name, s.countries, s.events_include, s.events_exclude, s.days_ago_start, s.days_ago_end, CURRENT_TIMESTAMP(), s.mode, s.query, s.ttl, s.split_ratio)
 """
-    logger.debug(query)
-    job_config = bigquery.QueryJobConfig()
-    job_config.query_parameters = query_params
-    self.bq_client.query(query, job_config=job_config).result()
+      logger.debug(query)
+      job_config = bigquery.QueryJobConfig(query_parameters=[
+          bigquery.ArrayQueryParameter('rows', 'STRUCT', rows)
+      ])
+      self.bq_client.query(query, job_config=job_config).result()
+      _invalidate_audiences(self.config.project_id, target.bq_dataset_id)
 
     # delete removed audiences
-    sql_names_to_delete = ','.join(
-        ["'" + item.name + "'" for item in to_remove])
-    if sql_names_to_delete:
-      query = (f'DELETE FROM `{table_name}` '
-               f'WHERE name in ({sql_names_to_delete})')
+    names_to_delete = [item.name for item in to_remove]
+    if names_to_delete:
+      query = f'DELETE FROM `{table_name}` WHERE name IN UNNEST(@names)'
       logger.debug(query)
-      self.bq_client.query(query).result()
+      job_config = bigquery.QueryJobConfig(query_parameters=[
+          bigquery.ArrayQueryParameter('names', 'STRING', names_to_delete)
+      ])
+      # don't wait for the job, meanwhile remove audiences' tables
+      delete_job = self.bq_client.query(query, job_config=job_config)
+      with ThreadPoolExecutor(max_workers=8) as executor:
+        list(
+            executor.map(
+                lambda audience: self._on_audience_removed(target, audience),
+                to_remove))
+      delete_job.result()
+      _invalidate_audiences(self.config.project_id, target.bq_dataset_id)
 
-    names_to_delete = [item.name for item in to_remove]
     result = {'deleted': names_to_delete}
-
-    for audience in to_remove:
-      self._on_audience_removed(target, audience)
     return result
 
   def _on_audience_removed(self, target: ConfigTarget, audience: Audience):
     table_name = target.bq_dataset_id + '.' + audience.table_name
     self.bq_client.delete_table(table_name, not_found_ok=True)
-    for suffix in ['all', 'test', 'control', 'uploaded']:
-      self._delete_audience_tables(target, audience.table_name, suffix)
+    # segment tables (that could have been cached) are deleted below
+    _invalidate_table_meta()
+    self._delete_audience_tables(target, audience.table_name,
+                                 ['all', 'test', 'control', 'uploaded'])
 
   def _delete_audience_tables(self, target: ConfigTarget, table_name: str,
-                              suffix: str):
+                              suffixes: list[str]):
     meta_table_name = target.bq_dataset_id + '.INFORMATION_SCHEMA.TABLES'
+    # tables for all suffixes are listed at once
     query = f"""SELECT table_name
   FROM {meta_table_name}
-  WHERE table_name like '{table_name}_{suffix}_%'
-  ORDER BY 1"""
-    rows = self.execute_query(query)
-    for row in rows:
-      table_name = target.bq_dataset_id + '.' + row['table_name']
-      self.bq_client.delete_table(table_name, not_found_ok=True)
+  WHERE table_name LIKE ANY UNNEST(@patterns)"""
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter(
+            'patterns', 'STRING',
+            [f'{table_name}_{suffix}_%' for suffix in suffixes])
+    ])
+    tables = self.execute_query_arrow(
+        query, job_config).column('table_name').to_pylist()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+      list(
+          executor.map(
+              lambda table: self.bq_client.delete_table(
+                  f'{target.bq_dataset_id}.{table}', not_found_ok=True),
+              tables))
 
   def _read_file(self, filename):
-    script_path = os.path.realpath(__file__)
-    script_dir = os.path.dirname(script_path)
-    filename = os.path.join(script_dir, filename)
-    with open(filename) as f:
-      query = f.read()
-    return query
+    return _read_template(filename)
 
   def get_audience_sampling_query(self, target: ConfigTarget,
                                   audience: Audience):
@@ -806,15 +1158,10 @@ WHEN NOT MATCHED THEN
       all_events = ['session_start'] + all_events
 
     all_events_list = ', '.join([f"'{event}'" for event in all_events])
-    search_condition = ''
-    if events_include:
-      search_condition += ' AND '.join(
-          [f"'{event}' IN UNNEST(events)" for event in events_include])
-    if search_condition:
-      search_condition += ' AND '
-    if events_exclude:
-      search_condition += ' AND '.join(
-          [f"'{event}' NOT IN UNNEST(events)" for event in events_exclude])
+    conditions = [
+        f"'{event}' IN UNNEST(events)" for event in events_include
+    ] + [f"'{event}' NOT IN UNNEST(events)" for event in events_exclude]
+    search_condition = ' AND '.join(conditions) or 'TRUE'
 
     if audience.query:
       query = audience.query
@@ -839,7 +1186,7 @@ WHEN NOT MATCHED THEN
               'countries':
                   countries,
               'all_users_table':
-                  target.bq_dataset_id + '.' + TABLE_USERS_NORMALIZED,
+                  f'{target.bq_dataset_id}.{TABLE_USERS_NORMALIZED}',
               'all_events_list':
                   all_events_list,
               'SEARCH_CONDITIONS':
@@ -909,7 +1256,7 @@ WHEN NOT MATCHED THEN
               'source_table':
                   self.get_ga4_table_name(target, True),
               'all_users_table':
-                  target.bq_dataset_id + '.' + TABLE_USERS_NORMALIZED,
+                  f'{target.bq_dataset_id}.{TABLE_USERS_NORMALIZED}',
               'date_start':
                   date_start.strftime('%Y%m%d'),
               'date_end':
@@ -1033,7 +1380,7 @@ WHEN NOT MATCHED THEN
       logger.debug('Creating users_normalized segment for %s - %s', start_day,
                    end_day)
       destination_table = f'{destination_table_base}_{end_day}'
-      query = f'CREATE OR REPLACE TABLE `{destination_table}` AS\n' + query
+      query = f'CREATE OR REPLACE TABLE `{destination_table}` AS\n{query}'
       self.execute_query(query)
       # it can happen that the new table captures no users.
       # that's because a GA4 export for yesterday hasn't arrived yet
@@ -1170,7 +1517,7 @@ HAVING COUNT(U.user) = 0
     destination_table = self.get_user_segment_table_full_name(
         target, audience.table_name, 'all', suffix)
     query = self.get_audience_sampling_query(target, audience)
-    query = f'CREATE OR REPLACE TABLE `{destination_table}` AS\n' + query
+    query = f'CREATE OR REPLACE TABLE `{destination_table}` AS\n{query}'
 
     self.execute_query(query)
 
@@ -1180,21 +1527,12 @@ HAVING COUNT(U.user) = 0
       # test/control tables can not yet exist (on the first day of sampling),
       # so if it's the case we're switching off return_only_new_users flag to
       # prevent fetching from them in load_sampled_users
-      query = f"""SELECT table_name
-  FROM {target.bq_dataset_id}.INFORMATION_SCHEMA.TABLES
-  WHERE table_name like '{audience.table_name}_test_%'
-  LIMIT 1"""
-      rows = self.execute_query(query)
-      if not rows:
+      # (both groups are listed with one query)
+      if not (self._get_user_segment_tables(target, audience.table_name,
+                                            'test') and
+              self._get_user_segment_tables(target, audience.table_name,
+                                            'control')):
         return_only_new_users = False
-      else:
-        query = f"""SELECT table_name
-  FROM {target.bq_dataset_id}.INFORMATION_SCHEMA.TABLES
-  WHERE table_name like '{audience.table_name}_control_%'
-  LIMIT 1"""
-        rows = self.execute_query(query)
-        if not rows:
-          return_only_new_users = False
 
     logger.debug('Loading sampled users for segment, return_only_new_users=%s',
                  return_only_new_users)
@@ -1235,23 +1573,66 @@ SELECT
 FROM `{audience_table_name}` a
 """
     if only_new_users:
-      query += f"""WHERE
-  NOT EXISTS (
-    SELECT user
-    FROM `{self.get_user_segment_table_full_name(target, audience.table_name, 'control', '*')}` t
-    WHERE t.user=a.user AND _TABLE_SUFFIX < '{suffix}'
-  ) AND NOT EXISTS (
-    SELECT user
-    FROM `{self.get_user_segment_table_full_name(target, audience.table_name, 'test', '*')}` t
-    WHERE t.user=a.user AND _TABLE_SUFFIX < '{suffix}'
-  )"""
-
-    logger.debug('Executing SQL query: %s', query)
-    df = pd.read_gbq(
-        query=query,
-        project_id=self.config.project_id,
-        credentials=self.credentials)
-    return df
+      # anti-join against distinct users of previous days (a user repeats in
+      # every daily table, so deduplicating first shrinks the join a lot)
+      control_prev_table_name = self.get_user_segment_table_full_name(
+          target, audience.table_name, 'control', '*')
+      test_prev_table_name = self.get_user_segment_table_full_name(
+          target, audience.table_name, 'test', '*')
+      query += f"""LEFT JOIN (
+  SELECT user FROM `{control_prev_table_name}`
+  WHERE _TABLE_SUFFIX < @suffix
+  UNION DISTINCT
+  SELECT user FROM `{test_prev_table_name}`
+  WHERE _TABLE_SUFFIX < @suffix
+) t USING(user)
+WHERE t.user IS NULL"""
+
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('suffix', 'STRING', suffix)
+    ]) if only_new_users else None
+    # download results via BigQuery Storage API (Arrow) instead of REST,
+    # numeric features are small, so use narrower (but nullable) ints,
+    # user ids are kept in Arrow buffers instead of Python str objects
+    return self._read_gbq_df(
+        query,
+        job_config=job_config,
+        dtypes={
+            'user': pd.ArrowDtype(pa.string()),
+            'n_sessions': 'Int32',
+            'days_since_install': 'Int32'
+        })
+
+  def _list_segment_tables(self, bq_dataset_id: str, audience_table_name: str,
+                           group_name: str) -> tuple[str, ...]:
+    """Return names of an audience group's daily tables (newest first).
+
+    Results are cached for the lifetime of the gateway,
+    the cache is reset when new segment tables are saved.
+    Test and control tables are usually needed together, so both groups are
+    listed with one query.
+    """
+    key = (bq_dataset_id, audience_table_name, group_name)
+    tables = self._segment_tables_cache.get(key)
+    if tables is None:
+      group_names = list(dict.fromkeys([group_name, 'test', 'control']))
+      query = f"""SELECT table_name
+FROM {bq_dataset_id}.INFORMATION_SCHEMA.TABLES
+WHERE table_name LIKE ANY UNNEST(@patterns) ORDER BY 1 DESC"""
+      job_config = bigquery.QueryJobConfig(query_parameters=[
+          bigquery.ArrayQueryParameter(
+              'patterns', 'STRING',
+              [f'{audience_table_name}_{name}_%' for name in group_names])
+      ])
+      all_tables = self.execute_query_arrow(
+          query, job_config).column('table_name').to_pylist()
+      for name in group_names:
+        prefix = f'{audience_table_name}_{name}_'
+        group_tables = tuple(t for t in all_tables if t.startswith(prefix))
+        self._segment_tables_cache[(bq_dataset_id, audience_table_name,
+                                    name)] = group_tables
+      tables = self._segment_tables_cache[key]
+    return tables
 
   def _get_user_segment_tables(self,
                                target: ConfigTarget,
@@ -1259,14 +1640,11 @@ FROM `{audience_table_name}` a
                                group_name: Literal['test', 'control'] = 'test',
                                include_dataset=False) -> list[str]:
     bq_dataset_id = target.bq_dataset_id
-    query = f"""SELECT table_name
-FROM {bq_dataset_id}.INFORMATION_SCHEMA.TABLES
-WHERE table_name LIKE '{audience_table_name}_{group_name}_%' ORDER BY 1 DESC"""
-    rows = self.execute_query(query)
-    tables = [row['table_name'] for row in rows]
+    tables = self._list_segment_tables(bq_dataset_id, audience_table_name,
+                                       group_name)
     if include_dataset:
       return [f'{bq_dataset_id}.{t}' for t in tables]
-    return tables
+    return list(tables)
 
   def get_user_segment_table_full_name(self,
                                        target: ConfigTarget,
@@ -1289,6 +1667,64 @@ WHERE table_name LIKE '{audience_table_name}_{group_name}_%' ORDER BY 1 DESC"""
         f'{bq_dataset_id}.{audience_table_name}_{group_name}_{suffix}')
     return test_table_name
 
+  def _read_gbq_df(
+      self,
+      query: str,
+      dtypes: dict[str, Any] | None = None,
+      job_config: bigquery.QueryJobConfig | None = None) -> pd.DataFrame:
+    """Execute a query and download results as DataFrame via Storage API."""
+    query_job = self._submit_query(query, job_config)
+    try:
+      results = query_job.result()
+    except exceptions.BadRequest as e:
+      raise self._get_query_error(e, query_job.query) from e
+    return results.to_dataframe(
+        bqstorage_client=self._get_storage_client_for(results),
+        create_bqstorage_client=False,
+        dtypes=dtypes)
+
+  def _load_df(
+      self,
+      df: pd.DataFrame,
+      table: str | bigquery.Table,
+      schema: list[bigquery.SchemaField],
+      write_disposition: str = bigquery.WriteDisposition.WRITE_TRUNCATE,
+      time_partitioning: bigquery.TimePartitioning | None = None,
+      clustering_fields: list[str] | None = None):
+    """Load a DataFrame into a table with a load job and wait for it.
+
+    Args:
+      df: DataFrame to load (columns should match the schema).
+      table: A fully qualified table name or a table.
+      schema: The table schema.
+      write_disposition: What to do with existing rows, by default - replace.
+      time_partitioning: The table partitioning (to keep it on replacing).
+      clustering_fields: The table clustering (to keep it on replacing).
+    """
+    # DataFrame is serialized to Parquet with column types from the schema
+    job_config = bigquery.LoadJobConfig(
+        write_disposition=write_disposition,
+        schema=schema,
+        source_format=bigquery.SourceFormat.PARQUET,
+        time_partitioning=time_partitioning,
+        clustering_fields=clustering_fields)
+    self.bq_client.load_table_from_dataframe(
+        df, table, job_config=job_config).result()
+
+  def _save_segment_users(self, table_name: str, df: pd.DataFrame,
+                          schema: list[bigquery.SchemaField]):
+    """Overwrite a segment table with users from a DataFrame.
+
+    Args:
+      table_name: A fully qualified segment table name.
+      df: DataFrame with users (columns should match the schema).
+      schema: The segment table schema.
+    """
+    if len(df) == 0:
+      self._ensure_table(table_name, schema)
+      return
+    self._load_df(df, table_name, schema)
+
   def save_sampled_users(self,
                          target: ConfigTarget,
                          audience: Audience,
@@ -1307,43 +1743,55 @@ WHERE table_name LIKE '{audience_table_name}_{group_name}_%' ORDER BY 1 DESC"""
       users_control: DataFrame with control users ids (with 'user' column).
       suffix: A day suffix as yyyymmdd, by default - today.
     """
-    project_id = self.config.project_id
-    # test group:
     test_table_name = self.get_user_segment_table_full_name(
         target, audience.table_name, 'test', suffix)
-    if len(users_test) == 0:
-      self._ensure_table(test_table_name, TableSchemas.daily_test_users)
-    else:
-      # add 'status' column (empty for all rows)
-      users_test = users_test.assign(status=None).astype({'status': 'Int64'})
-      # add 'ttl' column with audience's initial ttl
-      users_test = users_test.assign(ttl=audience.ttl).astype({'ttl': 'Int64'})
-      pandas_gbq.to_gbq(
-          users_test[['user', 'status', 'ttl']],
-          test_table_name,
-          project_id,
-          if_exists='replace')
-
-    # control group:
     control_table_name = self.get_user_segment_table_full_name(
         target, audience.table_name, 'control', suffix)
-    if len(users_control) == 0:
-      self._ensure_table(control_table_name, TableSchemas.daily_control_users)
-    else:
-      # add 'ttl' column with audience's initial ttl
-      users_control = users_control.assign(ttl=audience.ttl).astype(
-          {'ttl': 'Int64'})
-      pandas_gbq.to_gbq(
-          users_control[['user', 'ttl']],
-          control_table_name,
-          project_id,
-          if_exists='replace')
+    # build typed columns directly instead of assign+astype copies:
+    # 'status' is empty for all rows, 'ttl' is audience's initial ttl
+    count = len(users_test)
+    df_test = pd.DataFrame({
+        'user': users_test['user'],
+        'status': pd.array([pd.NA] * count, dtype='Int64'),
+        'ttl': pd.array([audience.ttl] * count, dtype='Int64')
+    })
+    df_control = pd.DataFrame({
+        'user': users_control['user'],
+        'ttl': pd.array([audience.ttl] * len(users_control), dtype='Int64')
+    })
+    # test and control tables are written independently, so do it concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+      future_test = executor.submit(self._save_segment_users, test_table_name,
+                                    df_test, TableSchemas.daily_test_users)
+      future_control = executor.submit(self._save_segment_users,
+                                       control_table_name, df_control,
+                                       TableSchemas.daily_control_users)
+      future_test.result()
+      future_control.result()
+
+    # new segment tables could have been created
+    self._segment_tables_cache.clear()
 
     logger.info(
         'Sampled users for audience %s saved to '
         '%s (%s rows)/%s (%s rows) tables', audience.name, test_table_name,
         len(users_test), control_table_name, len(users_control))
 
+  def save_uploaded_users(self, target: ConfigTarget, audience: Audience,
+                          users: list[str]):
+    """Save users uploaded to Google Ads into today's 'uploaded' table.
+
+    Args:
+      target: A target.
+      audience: An audience description.
+      users: Uploaded users ids.
+    """
+    table_name = self.get_user_segment_table_full_name(
+        target, audience.table_name, 'uploaded')
+    self._load_df(
+        pd.DataFrame({'user': users}), table_name,
+        TableSchemas.uploaded_users)
+
   def save_split_statistics(self,
                             target: ConfigTarget,
                             audience: Audience,
@@ -1440,40 +1888,35 @@ WHERE table_name LIKE '{audience_table_name}_{group_name}_%' ORDER BY 1 DESC"""
     suffix = datetime.now().strftime('%Y%m%d') if suffix is None else suffix
     segment_table_name = self.get_user_segment_table_full_name(
         target, audience.table_name, 'all', suffix)
-    # test:
-    group_table_name = self.get_user_segment_table_full_name(
-        target, audience.table_name, 'test', suffix)
-    group_prev_table_name = self.get_user_segment_table_full_name(
-        target, audience.table_name, 'test', '*')
     ttl = audience.ttl
-    query = f"""
+    # both groups are updated in one script job to save a round trip
+    statements = []
+    for group_name in ['test', 'control']:
+      group_table_name = self.get_user_segment_table_full_name(
+          target, audience.table_name, group_name, suffix)
+      group_prev_table_name = self.get_user_segment_table_full_name(
+          target, audience.table_name, group_name, '*')
+      statements.append(f"""
   INSERT INTO `{group_table_name}` (user, ttl)
-  SELECT user, {ttl} FROM `{segment_table_name}` t1
+  SELECT user, @ttl FROM `{segment_table_name}` t1
   WHERE
-    EXISTS (SELECT user FROM `{group_prev_table_name}` t WHERE t.user=t1.user AND _TABLE_SUFFIX < '{suffix}')
-  """
-    self.execute_query(query)
-    # control:
-    group_table_name = self.get_user_segment_table_full_name(
-        target, audience.table_name, 'control', suffix)
-    group_prev_table_name = self.get_user_segment_table_full_name(
-        target, audience.table_name, 'control', '*')
-    query = f"""
-  INSERT INTO `{group_table_name}` (user, ttl)
-  SELECT user, {ttl} FROM `{segment_table_name}` t1
-  WHERE
-    EXISTS (SELECT user FROM `{group_prev_table_name}` t WHERE t.user=t1.user AND _TABLE_SUFFIX < '{suffix}')
-  """
-    self.execute_query(query)
+    EXISTS (SELECT user FROM `{group_prev_table_name}` t WHERE t.user=t1.user AND _TABLE_SUFFIX < @suffix);
+  """)
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('ttl', 'INT64', ttl),
+        bigquery.ScalarQueryParameter('suffix', 'STRING', suffix)
+    ])
+    self.execute_query(''.join(statements), job_config=job_config)
 
   def _copy_users_from_previous_day(self, table_name, table_name_yesterday):
     logger.debug('Adding users with TTL>1 from yesterday (%s)',
                  table_name_yesterday)
+    # anti-join as LEFT JOIN + IS NULL (cheaper plan than NOT EXISTS)
     query = f"""INSERT INTO `{table_name}` (user, ttl)
-  SELECT user, ttl-1 FROM `{table_name_yesterday}` t1
-  WHERE
-    NOT EXISTS (SELECT user FROM `{table_name}` WHERE user=t1.user)
-    AND ttl>1
+  SELECT t1.user, t1.ttl - 1
+  FROM `{table_name_yesterday}` t1
+  LEFT JOIN `{table_name}` t2 USING(user)
+  WHERE t2.user IS NULL AND t1.ttl > 1
   """
     self.execute_query(query)
     logger.debug('Added test users from previous day with TTL>1')
@@ -1535,8 +1978,7 @@ WHERE table_name LIKE '{audience_table_name}_{group_name}_%' ORDER BY 1 DESC"""
                                                        group_name, suffix)
     query = f"""SELECT user FROM `{table_name}`"""
     try:
-      rows = self.execute_query(query)
-      users = [row['user'] for row in rows]
+      users = self.execute_query_arrow(query).column('user').to_pylist()
     except exceptions.NotFound:
       logger.debug("Table '%s' not found (audience segment is empty)",
                    table_name)
@@ -1563,6 +2005,15 @@ WHERE table_name LIKE '{audience_table_name}_{group_name}_%' ORDER BY 1 DESC"""
     if not failed_users:
       query = f"""UPDATE `{table_name}` SET status = 1 WHERE true"""
       self.execute_query(query)
+    elif len(failed_users) < FAILED_USERS_INLINE_THRESHOLD:
+      # pass a few failed users as a query parameter (no staging table)
+      query = f"""UPDATE `{table_name}`
+SET status = IF(user IN UNNEST(@failed), 0, 1)
+WHERE true"""
+      job_config = bigquery.QueryJobConfig(query_parameters=[
+          bigquery.ArrayQueryParameter('failed', 'STRING', failed_users)
+      ])
+      self.execute_query(query, job_config=job_config)
     else:
       # create a table for failed users
       table_name_failed = self.get_user_segment_table_full_name(
@@ -1570,28 +2021,33 @@ WHERE table_name LIKE '{audience_table_name}_{group_name}_%' ORDER BY 1 DESC"""
       schema = [bigquery.SchemaField('user', 'STRING', mode='REQUIRED')]
       table_ref = bigquery.TableReference.from_string(table_name_failed,
                                                       self.config.project_id)
-      table = bigquery.Table(table_ref, schema=schema)
-      table = self.bq_client.create_table(table, exists_ok=True)
-      rows_to_insert = [{'user': user_id} for user_id in failed_users]
+      # users are deduplicated here, so the MERGE below can use the table
+      # as is (a target row must not match several source rows)
+      data = '\n'.join(
+          json.dumps({'user': user_id})
+          for user_id in dict.fromkeys(failed_users)).encode()
+      job_config = bigquery.LoadJobConfig(
+          schema=schema,
+          source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+          write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
       try:
-        self.bq_client.insert_rows(table, rows_to_insert)
+        # a load job (unlike streaming inserts) uploads all rows in one request
+        # and doesn't leave them in the streaming buffer
+        self.bq_client.load_table_from_file(
+            io.BytesIO(data), table_ref, job_config=job_config).result()
       except BaseException as e:
         logger.error(
             'An error occurred while inserting failed users into %s table: %s',
             table_name_failed, e)
         raise
-      # now join failed users from the newly created _failed table
-      # with the segment table
+      # now merge failed users from the newly created _failed table
+      # into the segment table
       query = f"""
-UPDATE `{table_name}` t1
-SET status = IF(t2.failed IS NULL, 1, 0)
-FROM (
-  SELECT t.user as user, f.user as failed
-  FROM `{table_name}` t
-  LEFT JOIN `{table_name_failed}` f
-  USING(user)
-) t2
-WHERE t1.user = t2.user
+MERGE `{table_name}` t
+USING `{table_name_failed}` f
+ON t.user = f.user
+WHEN MATCHED THEN UPDATE SET status = 0
+WHEN NOT MATCHED BY SOURCE THEN UPDATE SET status = 1
       """
       self.execute_query(query)
 
@@ -1611,132 +2067,179 @@ WHERE t1.user = t2.user
       A tuple with test_user_count, control_user_count,
         new_test_user_count, new_control_user_count.
     """
-    # load test and control user counts
+    suffix = datetime.now().strftime('%Y%m%d') if suffix is None else suffix
     test_table_name = self.get_user_segment_table_full_name(
         target, audience.table_name, 'test', suffix)
-    query = (
-        f'SELECT COUNT(1) as count FROM `{test_table_name}` WHERE status = 1')
-    try:
-      test_user_count = self.execute_query(query)[0]['count']
-    except exceptions.NotFound:
-      logger.info(
-          "Table '%s' does not exist, skipping loading a user segment for %s",
-          test_table_name, suffix)
-      return 0, 0, 0, 0
     control_table_name = self.get_user_segment_table_full_name(
         target, audience.table_name, 'control', suffix)
-    query = f'SELECT COUNT(1) as count FROM `{control_table_name}`'
-    control_user_count = self.execute_query(query)[0]['count']
-
-    # load new user count
     table_name_prev = self.get_user_segment_table_full_name(
         target, audience.table_name, 'test', '*')
-    suffix = datetime.now().strftime('%Y%m%d') if suffix is None else suffix
-    # we're fetching the number of unique users in all test tables
-    # with date suffix below the current suffix
-    query = f"""SELECT count(DISTINCT t.user) as user_count
-FROM `{test_table_name}` t
-WHERE status = 1 AND NOT EXISTS (
-  SELECT * FROM `{table_name_prev}` t0
-  WHERE t0._TABLE_SUFFIX < '{suffix}' AND t.user = t0.user AND t0.status = 1
-)
-    """
-    res = self.execute_query(query)
-    new_test_user_count = res[0]['user_count']
-
     control_table_name_prev = self.get_user_segment_table_full_name(
         target, audience.table_name, 'control', '*')
-    query = f"""SELECT count(DISTINCT t.user) as user_count
-FROM `{control_table_name}` t
-WHERE NOT EXISTS (
-  SELECT * FROM `{control_table_name_prev}` t0
-  WHERE t0._TABLE_SUFFIX < '{suffix}' AND t.user = t0.user
-)
+    # all four counts are fetched in one job, new users are ones that are
+    # absent in all tables with date suffix below the current suffix
+    # (the window isn't bounded from below, otherwise users seen long ago
+    # would be counted as new)
+    query = f"""SELECT
+  (SELECT COUNT(1) FROM `{test_table_name}` WHERE status = 1) AS test_count,
+  (SELECT COUNT(1) FROM `{control_table_name}`) AS control_count,
+  (
+    SELECT COUNT(DISTINCT t.user)
+    FROM `{test_table_name}` t
+    LEFT JOIN (
+      SELECT DISTINCT user FROM `{table_name_prev}`
+      WHERE _TABLE_SUFFIX < @suffix AND status = 1
+    ) t0 USING(user)
+    WHERE t.status = 1 AND t0.user IS NULL
+  ) AS new_test_count,
+  (
+    SELECT COUNT(DISTINCT t.user)
+    FROM `{control_table_name}` t
+    LEFT JOIN (
+      SELECT DISTINCT user FROM `{control_table_name_prev}`
+      WHERE _TABLE_SUFFIX < @suffix
+    ) t0 USING(user)
+    WHERE t0.user IS NULL
+  ) AS new_control_count
     """
-    res = self.execute_query(query)
-    new_control_user_count = res[0]['user_count']
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('suffix', 'STRING', suffix)
+    ])
+    try:
+      row = self.execute_query(query, job_config=job_config)[0]
+    except exceptions.NotFound:
+      logger.info(
+          "Table '%s' does not exist, skipping loading a user segment for %s",
+          test_table_name, suffix)
+      return 0, 0, 0, 0
+    test_user_count = row['test_count']
+    control_user_count = row['control_count']
+    new_test_user_count = row['new_test_count']
+    new_control_user_count = row['new_control_count']
     return (test_user_count, control_user_count, new_test_user_count,
             new_control_user_count)
 
-  def update_audiences_log(self, target: ConfigTarget, logs: list[AudienceLog]):
+  def update_audiences_log(self,
+                           target: ConfigTarget,
+                           logs: list[AudienceLog],
+                           overwrite: bool = False):
     """Insert audience upload log entries into audience_log table.
 
     Args:
       target: A target.
       logs: Upload log entries.
+      overwrite: Replace all existing entries in the table with `logs`
+        (atomically, with one load job).
     """
     table_name = f'{target.bq_dataset_id}.audiences_log'
     custom_retry = retry.Retry(
         timeout=60, predicate=retry.if_exception_type(exceptions.NotFound))
     table = self.bq_client.get_table(table_name, retry=custom_retry)
-    rows = [{
-        'name': i.name,
-        'date': i.date if i.date else datetime.now(),
-        'job': i.job_resource_name,
-        'user_count': i.uploaded_user_count,
-        'new_user_count': i.new_test_user_count,
-        'new_control_user_count': i.new_control_user_count,
-        'test_user_count': i.test_user_count,
-        'control_user_count': i.control_user_count,
-        'total_user_count': i.total_test_user_count,
-        'total_control_user_count': i.total_control_user_count
-    } for i in logs]
-    res = self.bq_client.insert_rows(table, rows)
-    if res and res[0] and res[0].get('errors', None):
-      msg = res[0].get('errors', None)[0].get('message', None)
-      if msg:
-        raise ValueError(f'Audience log entries failed to save: {msg}')
-
-    logger.debug('Saved audience_log: %s', rows)
+    df = self._audiences_log_to_df(logs)
+    # a single load job instead of streaming inserts (tabledata.insertAll)
+    try:
+      if overwrite:
+        # the table is recreated by the load, so its spec is passed along
+        self._load_df(df, table, TableSchemas.audiences_log,
+                      bigquery.WriteDisposition.WRITE_TRUNCATE,
+                      TableSchemas.audiences_log_partitioning,
+                      TableSchemas.audiences_log_clustering)
+      else:
+        self._load_df(df, table, TableSchemas.audiences_log,
+                      bigquery.WriteDisposition.WRITE_APPEND)
+    except exceptions.GoogleAPICallError as e:
+      raise ValueError(
+          f'Audience log entries failed to save: {e.message}') from e
+    finally:
+      _invalidate_audiences_log(self.config.project_id, target.bq_dataset_id)
+
+    logger.debug('Saved audience_log: %s', logs)
+
+  def _audiences_log_to_df(self, logs: list[AudienceLog]) -> pd.DataFrame:
+    """Convert audience log entries to a DataFrame with table columns."""
+    # table columns mapped to AudienceLog attributes
+    columns = {
+        'name': 'name',
+        'date': 'date',
+        'job': 'job_resource_name',
+        'user_count': 'uploaded_user_count',
+        'new_user_count': 'new_test_user_count',
+        'new_control_user_count': 'new_control_user_count',
+        'test_user_count': 'test_user_count',
+        'control_user_count': 'control_user_count',
+        'total_user_count': 'total_test_user_count',
+        'total_control_user_count': 'total_control_user_count'
+    }
+    df = pd.DataFrame(
+        {
+            column: [getattr(i, attr) for i in logs
+                    ] for column, attr in columns.items()
+        },
+        dtype=object)
+    # entries read back from BigQuery are tz-aware (UTC), new ones may be naive
+    df['date'] = pd.to_datetime(df['date'],
+                                utc=True).fillna(datetime.now(timezone.utc))
+    return df
 
   def get_audiences_log(
       self,
       target: ConfigTarget,
       *,
-      include_duplicates=False) -> dict[str, list[AudienceLog]]:
+      include_duplicates=False,
+      audience_name: str | None = None) -> dict[str, list[AudienceLog]]:
+    # the log is cached for a short time unless it's updated
+    cache_key = (self.config.project_id, target.bq_dataset_id,
+                 include_duplicates, audience_name)
+    with _AUDIENCES_LOG_LOCK:
+      result = _AUDIENCES_LOG_CACHE.get(cache_key)
+    if result is None:
+      result = self._load_audiences_log(target, include_duplicates,
+                                        audience_name)
+      with _AUDIENCES_LOG_LOCK:
+        _AUDIENCES_LOG_CACHE[cache_key] = result
+    # callers can modify the lists (e.g. sort them), so return copies
+    return {name: list(log_items) for name, log_items in result.items()}
+
+  def _load_audiences_log(
+      self, target: ConfigTarget, include_duplicates: bool,
+      audience_name: str | None) -> dict[str, list[AudienceLog]]:
     table_name = f'{target.bq_dataset_id}.audiences_log'
-    query = f"""SELECT * FROM
-(
-  SELECT
-    name,
-    date,
-    job,
-    user_count,
-    new_user_count,
-    new_control_user_count,
-    test_user_count,
-    control_user_count,
-    total_user_count,
-    total_control_user_count,
-    ROW_NUMBER() OVER (
-      PARTITION BY name, format_date('%Y%m%d', date)
-      ORDER BY name, date DESC
-    ) row_number
-  FROM `{table_name}`
-) t
-{"WHERE t.row_number = 1" if not include_duplicates else ""}
-ORDER BY name, date
+    fields = [
+        'name', 'date', 'job', 'user_count', 'new_user_count',
+        'new_control_user_count', 'test_user_count', 'control_user_count',
+        'total_user_count', 'total_control_user_count'
+    ]
+    params = []
+    condition = 'TRUE'
+    if audience_name:
+      # the table is clustered by name, so only the audience's blocks are read
+      condition = 'name = @name'
+      params.append(
+          bigquery.ScalarQueryParameter('name', 'STRING', audience_name))
+    # NOTE: QUALIFY requires WHERE (or GROUP BY/HAVING) in BigQuery
+    qualify = '' if include_duplicates else """QUALIFY ROW_NUMBER() OVER (
+  PARTITION BY name, format_date('%Y%m%d', date)
+  ORDER BY date DESC
+) = 1"""
+    query = f"""SELECT {', '.join(fields)}
+FROM `{table_name}`
+WHERE {condition}
+{qualify}
     """
-    rows = self.execute_query(query)
-
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=params, use_query_cache=True)
     result = {}
-    for name, group in groupby(rows, key=lambda x: x['name']):
-      log_items = []
-      for item in group:
-        log_item = AudienceLog(
-            name=item['name'],
-            date=item['date'],
-            job_resource_name=item['job'],
-            uploaded_user_count=item['user_count'],
-            new_test_user_count=item['new_user_count'],
-            new_control_user_count=item['new_control_user_count'],
-            test_user_count=item['test_user_count'],
-            control_user_count=item['control_user_count'],
-            total_test_user_count=item['total_user_count'],
-            total_control_user_count=item['total_control_user_count'],
-            failed_user_count=item['test_user_count'] - item['user_count'])
-        log_items.append(log_item)
-      result[name] = log_items
+    for batch in self._query_to_arrow_batches(query, job_config):
+      # fields are selected in AudienceLog's field order, so entries are
+      # constructed positionally (failed count is the only derived field)
+      for values in zip(*(batch.column(name).to_pylist() for name in fields)):
+        item = AudienceLog(*values, failed_user_count=0)
+        item.failed_user_count = (
+            item.test_user_count - item.uploaded_user_count)
+        result.setdefault(item.name, []).append(item)
+    # rows come unordered (sorting a small result is cheaper here than in BQ)
+    for items in result.values():
+      items.sort(key=lambda i: i.date)
     return result
 
   def get_user_conversions_query(
@@ -1769,29 +2272,79 @@ ORDER BY name, date
       date_start and date_end are dates for a period, if not specified
       they will be detected as first and last day of audience import.
     """
-    if date_start is None:
-      log = self.get_audiences_log(target)
-      log_rows = log.get(audience.name, None)
-      if log_rows is None:
-        # no imports for the audience, then we'll use the audience creation date
-        date_start = audience.created.date()
-      else:
-        # Start listing conversions makes sense from the day when first segment
-        # was uploaded to Google Ads
-        date_start = min(log_rows, key=lambda i: i.date).date.date()
-    if date_end is None:
-      # take last day of audience_log
-      rows = self.execute_query(f"""SELECT DATE(date) as day
+    query, params, date_start, date_end = self._build_user_conversions_query(
+        target, audience, strategy, date_start, date_end, country, events,
+        conv_window)
+    # the query is returned to be executed by users, so it should be
+    # self-contained
+    return _inline_query_parameters(query, params), date_start, date_end
+
+  def _get_audience_upload_dates(
+      self, target: ConfigTarget,
+      audience_name: str) -> tuple[date | None, date | None]:
+    """Return days of the first and the last uploads of an audience.
+
+    Args:
+      target: A target.
+      audience_name: An audience name.
+
+    Returns:
+      A tuple with first and last upload days (None if there were no uploads).
+    """
+    query = f"""SELECT DATE(MIN(date)) AS first_day, DATE(MAX(date)) AS last_day
   FROM `{target.bq_dataset_id}.audiences_log`
-  WHERE NAME = '{audience.name}'
-  ORDER BY date DESC
-  LIMIT 1""")
-      if rows:
-        date_end = rows[0].get('day', None)
-        logger.info('Detected date_end from audience_log (as last upload): %s',
-                    date_end)
-      if not date_end:
-        date_end = date.today() - timedelta(days=1)
+  WHERE name = @name"""
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter('name', 'STRING', audience_name)
+        ],
+        use_query_cache=True)
+    rows = self.execute_query(query, job_config=job_config)
+    if not rows:
+      return None, None
+    return rows[0]['first_day'], rows[0]['last_day']
+
+  def _build_user_conversions_query(
+      self,
+      target: ConfigTarget,
+      audience: Audience,
+      strategy: Literal['bounded', 'unbounded'],
+      date_start: date | None = None,
+      date_end: date | None = None,
+      country: list[str] | None = None,
+      events: list[str] | None = None,
+      conv_window: int | None = None
+  ) -> tuple[str, list[bigquery.ScalarQueryParameter |
+                       bigquery.ArrayQueryParameter], date, date]:
+    """Return a parameterized query for calculating conversions.
+
+    See `get_user_conversions_query` for arguments.
+
+    Returns:
+      A tuple (query, params, date_start, date_end) where params are
+      the query parameters for the query.
+    """
+    if date_start is None or date_end is None:
+      first_upload_date, last_upload_date = self._get_audience_upload_dates(
+          target, audience.name)
+      if date_start is None:
+        if first_upload_date is None:
+          # no imports for the audience, then we'll use the audience creation
+          # date
+          date_start = audience.created.date()
+        else:
+          # Start listing conversions makes sense from the day when first
+          # segment was uploaded to Google Ads
+          date_start = first_upload_date
+      if date_end is None:
+        # take last day of audience_log
+        date_end = last_upload_date
+        if date_end:
+          logger.info(
+              'Detected date_end from audience_log (as last upload): %s',
+              date_end)
+        else:
+          date_end = date.today() - timedelta(days=1)
 
     if events:
       conversion_events = events
@@ -1803,17 +2356,25 @@ ORDER BY name, date
       conversion_events = [
           item for item in audience.events_exclude if item != 'app_remove'
       ]
-    events_list = ', '.join([f"'{event}'" for event in conversion_events
-                            ]) if conversion_events else ''
-    if not events_list:
+    if not conversion_events:
       raise ValueError(
           "Conversions cannot be calculated as audience's conversion events "
           '(excluded_event or explicitly) were not specified')
     ga_table = self.get_ga4_table_name(target, True)
-    user_table = target.bq_dataset_id + '.' + audience.table_name
+    user_table = f'{target.bq_dataset_id}.{audience.table_name}'
+    params = [
+        bigquery.ArrayQueryParameter('events', 'STRING', conversion_events),
+        bigquery.ScalarQueryParameter('day_start', 'STRING',
+                                      date_start.strftime('%Y%m%d')),
+        bigquery.ScalarQueryParameter('day_end', 'STRING',
+                                      date_end.strftime('%Y%m%d')),
+        bigquery.ScalarQueryParameter('app_id', 'STRING', audience.app_id),
+        bigquery.ScalarQueryParameter('audience_name', 'STRING',
+                                      audience.name),
+    ]
     if country:
-      country_list = ','.join([f"'{c}'" for c in country])
-      conversions_conditions = f'AND country IN ({country_list})'
+      params.append(bigquery.ArrayQueryParameter('country', 'STRING', country))
+      conversions_conditions = 'AND country IN UNNEST(@country)'
       query_total_counts = self._read_file(
           'results_parts_TotalCounts_bycountry.sql')
     else:
@@ -1824,6 +2385,10 @@ ORDER BY name, date
       query = self._read_file('results.sql')
     else:
       query = self._read_file('results_unbounded.sql')
+      # forward-looking conversion window for unbounded strategy
+      params.append(
+          bigquery.ScalarQueryParameter('conv_window', 'INT64',
+                                        conv_window or 14))
 
     class Default(dict):
       """Special dict used for `str.format` to tolerate missing args."""
@@ -1836,35 +2401,18 @@ ORDER BY name, date
         **{
             'source_table':
                 ga_table,
-            'events':
-                events_list,
-            'day_start':
-                date_start.strftime('%Y%m%d'),
-            'day_end':
-                date_end.strftime('%Y%m%d'),
             'all_users_table':
-                target.bq_dataset_id + '.' + TABLE_USERS_NORMALIZED,
+                f'{target.bq_dataset_id}.{TABLE_USERS_NORMALIZED}',
             'SEARCH_CONDITIONS':
                 conversions_conditions,
-            'app_id':
-                audience.app_id,
             'test_users_table':
-                user_table + '_test_*',
+                f'{user_table}_test_*',
             'control_users_table':
-                user_table + '_control_*',
-            'date_start':
-                date_start.strftime('%Y-%m-%d'),
-            'date_end':
-                date_end.strftime('%Y-%m-%d'),
+                f'{user_table}_control_*',
             'audiences_log':
-                target.bq_dataset_id + '.audiences_log',
-            'audience_name':
-                audience.name,
-            # forward-looking conversion window for unbounded strategy
-            'conv_window':
-                conv_window or 14
+                f'{target.bq_dataset_id}.audiences_log',
         })
-    return query, date_start, date_end
+    return query, params, date_start, date_end
 
   def get_user_conversions(
       self,
@@ -1903,10 +2451,12 @@ ORDER BY name, date
       date_start and date_end are dates for a period, if not specified
       they will be detected as first and last day of audience import.
     """
-    query, date_start, date_end = self.get_user_conversions_query(
+    query, params, date_start, date_end = self._build_user_conversions_query(
         target, audience, strategy, date_start, date_end, country, events,
         conv_window)
-    result = self.execute_query(query)
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=params, use_query_cache=True)
+    result = self.execute_query(query, job_config=job_config)
     return result, date_start, date_end
 
   def rebuilt_audiences_log(
@@ -1926,33 +2476,10 @@ ORDER BY name, date
       A mapping of audience name to its upload log entries
     """
     audiences = self.get_audiences(target)
-    audiences_log = self.get_audiences_log(target, include_duplicates=True)
-
-    table_fq_name = f'{target.bq_dataset_id}.audiences_log'
-    # 'DELETE FROM' usually fail with error:
-    #   "UPDATE or DELETE statement over table 'table_name' would affect rows
-    #   in the streaming buffer, which is not supported"
-    # So we're using either DROP TABLE or copying
-    if not audience_name:
-      query = f'DROP TABLE `{table_fq_name}`'
-      self.execute_query(query)
-      self._ensure_table(table_fq_name, TableSchemas.audiences_log)
-    else:
-      # we're asked to rebuild logs only for one audience.
-      # so basically we're recreating the table without rows for that audience
-      query = f"""CREATE TABLE `{table_fq_name}_new` LIKE `{table_fq_name}`;
-
-INSERT INTO `{table_fq_name}_new`
-SELECT * FROM {table_fq_name}
-WHERE name != '{audience_name}';
-
-DROP TABLE `{table_fq_name}`;
-
--- Rename the new table
-ALTER TABLE `{table_fq_name}_new` RENAME TO audiences_log;
-      """
-      self.execute_query(query)
+    # existing entries are read uncached as the table is rewritten below
+    audiences_log = self._load_audiences_log(target, True, audience_name)
 
+    logs: list[AudienceLog] = []
     result = {}
     # recreate log entries for each audience
     for audience in audiences:
@@ -1964,10 +2491,55 @@ ALTER TABLE `{table_fq_name}_new` RENAME TO audiences_log;
       audience_log = self._recalculate_audience_log(target, audience,
                                                     audience_log_existing)
       if audience_log:
-        self.update_audiences_log(target, audience_log)
-      result[audience_name] = audience_log
+        logs.extend(audience_log)
+      result[audience.name] = audience_log
+
+    if not audience_name:
+      # the whole table is rewritten by a single (atomic) load job
+      self.update_audiences_log(target, logs, overwrite=True)
+    else:
+      self._replace_audience_log(target, audience_name, logs)
     return result
 
+  def _replace_audience_log(self, target: ConfigTarget, audience_name: str,
+                            logs: list[AudienceLog]):
+    """Replace log entries of one audience keeping entries of others.
+
+    Entries are loaded into a staging table first and then swapped in one
+    transaction, so a failure at any step leaves the log as it was.
+
+    Args:
+      target: A target.
+      audience_name: An audience name.
+      logs: New log entries of the audience.
+    """
+    table_name = f'{target.bq_dataset_id}.audiences_log'
+    # a staging table per audience, so concurrent rebuilds don't clash
+    name_hash = hashlib.md5(audience_name.encode()).hexdigest()[:16]
+    table_name_new = f'{table_name}_rebuild_{name_hash}'
+    insert = ''
+    if logs:
+      insert = f'INSERT INTO `{table_name}` SELECT * FROM `{table_name_new}`;'
+    # the log is written with load jobs (not streaming inserts),
+    # so DML doesn't hit the streaming buffer
+    query = f"""BEGIN TRANSACTION;
+DELETE FROM `{table_name}` WHERE name = @name;
+{insert}
+COMMIT TRANSACTION;"""
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('name', 'STRING', audience_name)
+    ])
+    try:
+      if logs:
+        self._load_df(
+            self._audiences_log_to_df(logs), table_name_new,
+            TableSchemas.audiences_log)
+      self.execute_query(query, job_config=job_config)
+    finally:
+      _invalidate_audiences_log(self.config.project_id, target.bq_dataset_id)
+      if logs:
+        self.bq_client.delete_table(table_name_new, not_found_ok=True)
+
   def _recalculate_audience_log(
       self,
       target: ConfigTarget,
@@ -1975,51 +2547,83 @@ ALTER TABLE `{table_fq_name}_new` RENAME TO audiences_log;
       audience_log_existing: list[AudienceLog] = None):
     logger.info("Starting recalculating log for audience '%s'", audience.name)
     audience_log_existing = audience_log_existing or []
-    table_users = self.get_user_segment_table_full_name(target,
-                                                        audience.table_name,
-                                                        'test', '*')
-    query = f"""SELECT
-  MIN(_TABLE_SUFFIX) AS start_day,
-  MAX(_TABLE_SUFFIX) AS end_day
-FROM `{table_users}`"""
+    test_tables = self.get_user_segment_table_full_name(
+        target, audience.table_name, 'test', '*')
+    control_tables = self.get_user_segment_table_full_name(
+        target, audience.table_name, 'control', '*')
+    # NOTE: it's the same stat as load_user_segment_stat returns but for
+    # all days at once, a user is new on a day if it's the first day
+    # (the minimal suffix) when the user appeared in a group
+    query = f"""WITH
+  TestUsers AS (
+    SELECT _TABLE_SUFFIX AS day, user, status FROM `{test_tables}`
+  ),
+  ControlUsers AS (
+    SELECT _TABLE_SUFFIX AS day, user FROM `{control_tables}`
+  ),
+  TestStat AS (
+    SELECT day, COUNTIF(status = 1) AS test_user_count
+    FROM TestUsers
+    GROUP BY day
+  ),
+  ControlStat AS (
+    SELECT day, COUNT(1) AS control_user_count
+    FROM ControlUsers
+    GROUP BY day
+  ),
+  NewTestStat AS (
+    SELECT day, COUNT(1) AS new_test_user_count
+    FROM (
+      SELECT user, MIN(day) AS day FROM TestUsers WHERE status = 1 GROUP BY user
+    )
+    GROUP BY day
+  ),
+  NewControlStat AS (
+    SELECT day, COUNT(1) AS new_control_user_count
+    FROM (SELECT user, MIN(day) AS day FROM ControlUsers GROUP BY user)
+    GROUP BY day
+  )
+SELECT
+  day,
+  test_user_count,
+  IFNULL(control_user_count, 0) AS control_user_count,
+  IFNULL(new_test_user_count, 0) AS new_test_user_count,
+  IFNULL(new_control_user_count, 0) AS new_control_user_count
+FROM TestStat
+LEFT JOIN ControlStat USING (day)
+LEFT JOIN NewTestStat USING (day)
+LEFT JOIN NewControlStat USING (day)
+ORDER BY day"""
     try:
-      res = self.execute_query(query)
+      rows = self.execute_query(query)
     except exceptions.NotFound:
       return
     except QueryExecutionError:
       # if the audience wasn't sampled once, then the query fails:
       # "400 project:remarque.audience1_test_* does not match any table"
       return
-    if not res:
+    if not rows:
       return
-    res = res[0]
-    start_day = res['start_day']
-    end_day = res['end_day']
     logger.info(
         "Recalculating log for audience '%s': detected date range: [%s, %s]",
-        audience.name, start_day, end_day)
-    if start_day is None or end_day is None:
-      return
-    start_date = datetime.strptime(start_day, '%Y%m%d')
-    end_date = datetime.strptime(end_day, '%Y%m%d')
-    num_days = (end_date - start_date).days
+        audience.name, rows[0]['day'], rows[-1]['day'])
     total_test_user_count = 0
     total_control_user_count = 0
 
     logs = []
-    for day in range(num_days + 1):
-      current_day = start_date + timedelta(days=day)
-      (test_user_count, control_user_count, new_test_user_count,
-       new_control_user_count) = (
-           self.load_user_segment_stat(target, audience,
-                                       current_day.strftime('%Y%m%d')))
+    for row in rows:
+      test_user_count = row['test_user_count']
       if not test_user_count:
         continue
+      current_day = datetime.strptime(row['day'],
+                                      '%Y%m%d').replace(tzinfo=timezone.utc)
+      new_test_user_count = row['new_test_user_count']
+      new_control_user_count = row['new_control_user_count']
       total_test_user_count += new_test_user_count
       total_control_user_count += new_control_user_count
       existing_same_day_entries = list([
           i for i in audience_log_existing
-          if i.date.strftime('%Y%m%d') == current_day.strftime('%Y%m%d')
+          if i.date.strftime('%Y%m%d') == row['day']
       ])
       entry = AudienceLog(
           name=audience.name,
@@ -2031,7 +2635,7 @@ FROM `{table_users}`"""
           new_test_user_count=new_test_user_count,
           new_control_user_count=new_control_user_count,
           test_user_count=test_user_count,
-          control_user_count=control_user_count,
+          control_user_count=row['control_user_count'],
           total_test_user_count=total_test_user_count,
           total_control_user_count=total_control_user_count,
           failed_user_count=0,
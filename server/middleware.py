@@ -13,9 +13,9 @@
 #  limitations under the License.
 """Middleware methods."""
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pandas as pd
-import pandas_gbq
 
 from context import Context
 from sampling import split_via_stratification
@@ -103,10 +103,15 @@ def run_sampling_for_audience(
   context.data_gateway.add_yesterdays_users(context.target, audience)
 
   # finally load resulting sets of test and control users for today
-  test_users = context.data_gateway.load_audience_segment(
-      context.target, audience, 'test', suffix)
-  control_users = context.data_gateway.load_audience_segment(
-      context.target, audience, 'control', suffix)
+  # (both groups are independent, so they are loaded concurrently)
+  with ThreadPoolExecutor(max_workers=2) as executor:
+    future_test = executor.submit(context.data_gateway.load_audience_segment,
+                                  context.target, audience, 'test', suffix)
+    future_control = executor.submit(
+        context.data_gateway.load_audience_segment, context.target, audience,
+        'control', suffix)
+    test_users = future_test.result()
+    control_users = future_control.result()
 
   return test_users, control_users, split_result
 
@@ -179,15 +184,8 @@ def upload_customer_match_audience(context: Context,
   # for debug reason save uplaoded users
   # TODO: add some flag to control the behavior
   if len(uploaded_users):
-    uploaded_users_mapped = [[id] for id in uploaded_users]
-    df = pd.DataFrame(uploaded_users_mapped, columns=['user'])
-    uploaded_table_name = context.data_gateway.get_user_segment_table_full_name(
-        context.target, audience.table_name, 'uploaded')
-    pandas_gbq.to_gbq(
-        df[['user']],
-        uploaded_table_name,
-        context.config.project_id,
-        if_exists='replace')
+    context.data_gateway.save_uploaded_users(context.target, audience,
+                                             uploaded_users)
 
   # now calculate total numbers of users in the audience
   total_test_user_count = 0
@@ -14,17 +14,20 @@
 -- Calculates conversions for users in treatment and control groups.
 --
 -- @param source_table: A wildcarded name of GA4 table (events_*).
--- @param day_start: A start date formatted as %Y%m%d.
--- @param date_start: A start date formatted as %Y-%m-%d.
--- @param day_end: An end date formatted as %Y%m%d.
--- @param date_end: An end date formatted as %Y-%m-%d.
--- @param app_id: An application id.
--- @param events: A list of event names.
+-- @param day_start: A start date formatted as %Y%m%d (query parameter).
+-- @param day_end: An end date formatted as %Y%m%d (query parameter).
+-- @param app_id: An application id (query parameter).
+-- @param events: A list of event names (query parameter).
+-- @param audience_name: An audience name (query parameter).
+-- @param country: A list of countries (query parameter, only set when
+--  conversions are filtered by country).
 -- @param all_users_table: A fully qualified name of 'users_normalized' table.
 -- @param test_users_table: A wildcarded name of table with test users.
 -- @param control_users_table: A wildcarded name of table with control users.
+-- @param SEARCH_CONDITIONS: Additional conditions for users (e.g. countries).
 -- @param TotalCounts: A string with additional query that provides a
---  `TotalCounts` subquery, which contains its own params
+--  `TotalCounts` subquery (it uses the same query parameters and
+--  `audiences_log` table name).
 
 WITH
   AllConversions AS (
@@ -45,9 +48,9 @@ WITH
       device.operating_system = 'Android'
       AND device.advertising_id IS NOT NULL
       AND device.advertising_id NOT IN ('', '00000000-0000-0000-0000-000000000000', '0000-0000')
-      AND _TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
-      AND app_info.id = '{app_id}'
-      AND event_name IN ({events})
+      AND _TABLE_SUFFIX BETWEEN @day_start AND @day_end
+      AND app_info.id = @app_id
+      AND event_name IN UNNEST(@events)
   ),
   Conversions AS (
     SELECT *
@@ -55,7 +58,7 @@ WITH
     INNER JOIN `{all_users_table}` AS UN
       USING (user)
     WHERE
-      UN.app_id = '{app_id}'
+      UN.app_id = @app_id
       {SEARCH_CONDITIONS}
   ),
   TestConverted AS (
@@ -63,14 +66,14 @@ WITH
     FROM `{test_users_table}` AS U
     INNER JOIN Conversions AS C
       ON U.user = C.user AND U._TABLE_SUFFIX = C.reg_date
-    WHERE _TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+    WHERE _TABLE_SUFFIX BETWEEN @day_start AND @day_end
   ),
   ControlConverted AS (
     SELECT U.user, reg_date, reg_ts, conversion_value
     FROM `{control_users_table}` AS U
     INNER JOIN Conversions AS C
       ON U.user = C.user AND U._TABLE_SUFFIX = C.reg_date
-    WHERE _TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+    WHERE _TABLE_SUFFIX BETWEEN @day_start AND @day_end
   ),
   SessionCounts AS (
     SELECT
@@ -83,13 +86,13 @@ WITH
     LEFT JOIN `{control_users_table}` AS CU
       ON E.device.advertising_id = CU.user AND E._TABLE_SUFFIX = CU._TABLE_SUFFIX
     WHERE
-      E._TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+      E._TABLE_SUFFIX BETWEEN @day_start AND @day_end
       AND E.event_name = 'session_start'
-      AND E.app_info.id = '{app_id}'
+      AND E.app_info.id = @app_id
     GROUP BY 1
   ),
   Dates AS (
-    SELECT GENERATE_DATE_ARRAY('{date_start}', '{date_end}', INTERVAL 1 DAY) AS date_array
+    SELECT GENERATE_DATE_ARRAY(PARSE_DATE('%Y%m%d', @day_start), PARSE_DATE('%Y%m%d', @day_end), INTERVAL 1 DAY) AS date_array
   ),
   DatesFormatted AS (
     SELECT
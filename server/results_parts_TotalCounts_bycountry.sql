@@ -10,9 +10,9 @@
         _TABLE_SUFFIX IN (
           SELECT FORMAT_DATE('%E4Y%m%d', DATE(`date`)) AS day
           FROM `{audiences_log}`
-          WHERE name = '{audience_name}'
+          WHERE name = @audience_name
         )
-        AND app_id = '{app_id}'
+        AND app_id = @app_id
         {SEARCH_CONDITIONS}
       GROUP BY _TABLE_SUFFIX
 
@@ -29,9 +29,9 @@
         _TABLE_SUFFIX IN (
           SELECT FORMAT_DATE('%E4Y%m%d', DATE(`date`)) AS day
           FROM `{audiences_log}`
-          WHERE name = '{audience_name}'
+          WHERE name = @audience_name
         )
-        AND app_id = '{app_id}'
+        AND app_id = @app_id
         {SEARCH_CONDITIONS}
       GROUP BY _TABLE_SUFFIX
     )
@@ -14,18 +14,22 @@
 -- Calculates conversions for users in treatment and control groups.
 --
 -- @param source_table: A wildcarded name of GA4 table (events_*).
--- @param day_start: A start date formatted as %Y%m%d.
--- @param date_start: A start date formatted as %Y-%m-%d.
--- @param day_end: An end date formatted as %Y%m%d.
--- @param date_end: An end date formatted as %Y-%m-%d.
--- @param app_id: An application id.
--- @param events: A list of event names.
+-- @param day_start: A start date formatted as %Y%m%d (query parameter).
+-- @param day_end: An end date formatted as %Y%m%d (query parameter).
+-- @param app_id: An application id (query parameter).
+-- @param events: A list of event names (query parameter).
+-- @param audience_name: An audience name (query parameter).
+-- @param conv_window: A number of days for conversion window
+--  (query parameter).
+-- @param country: A list of countries (query parameter, only set when
+--  conversions are filtered by country).
 -- @param all_users_table: A fully qualified name of 'users_normalized' table.
 -- @param test_users_table: A wildcarded name of table with test users.
 -- @param control_users_table: A wildcarded name of table with control users.
+-- @param SEARCH_CONDITIONS: Additional conditions for users (e.g. countries).
 -- @param TotalCounts: A string with additional query that provides a
---  `TotalCounts` subquery, which contains its own params
--- @param conv_window: a number of days for conversion window
+--  `TotalCounts` subquery (it uses the same query parameters and
+--  `audiences_log` table name).
 
 WITH
   AllConversions AS (
@@ -46,9 +50,9 @@ WITH
       device.operating_system = 'Android'
       AND device.advertising_id IS NOT NULL
       AND device.advertising_id NOT IN ('', '00000000-0000-0000-0000-000000000000', '0000-0000')
-      AND _TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
-      AND app_info.id = '{app_id}'
-      AND event_name IN ({events})
+      AND _TABLE_SUFFIX BETWEEN @day_start AND @day_end
+      AND app_info.id = @app_id
+      AND event_name IN UNNEST(@events)
   ),
   Conversions AS (
     SELECT *
@@ -56,18 +60,18 @@ WITH
     INNER JOIN `{all_users_table}` AS UN
       USING (user)
     WHERE
-      UN.app_id = '{app_id}'
+      UN.app_id = @app_id
       {SEARCH_CONDITIONS}
   ),
   UserFirstAppearance AS (
     SELECT user, MIN(_TABLE_SUFFIX) AS first_appearance
     FROM `{test_users_table}`
-    WHERE _TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+    WHERE _TABLE_SUFFIX BETWEEN @day_start AND @day_end
     GROUP BY user
     UNION ALL
     SELECT user, MIN(_TABLE_SUFFIX) AS first_appearance
     FROM `{control_users_table}`
-    WHERE _TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+    WHERE _TABLE_SUFFIX BETWEEN @day_start AND @day_end
     GROUP BY user
   ),
   TestConverted AS (
@@ -78,11 +82,11 @@ WITH
     INNER JOIN UserFirstAppearance AS FA
       ON U.user = FA.user
     WHERE
-      U._TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+      U._TABLE_SUFFIX BETWEEN @day_start AND @day_end
       AND C.reg_date >= FA.first_appearance
       AND C.reg_date <= FORMAT_DATE('%Y%m%d', LEAST(
-        DATE_ADD(PARSE_DATE('%Y%m%d', FA.first_appearance), INTERVAL {conv_window} DAY),
-        PARSE_DATE('%Y%m%d', '{day_end}')
+        DATE_ADD(PARSE_DATE('%Y%m%d', FA.first_appearance), INTERVAL @conv_window DAY),
+        PARSE_DATE('%Y%m%d', @day_end)
       ))
   ),
   ControlConverted AS (
@@ -93,11 +97,11 @@ WITH
     INNER JOIN UserFirstAppearance AS FA
       ON U.user = FA.user
     WHERE
-      U._TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+      U._TABLE_SUFFIX BETWEEN @day_start AND @day_end
       AND C.reg_date >= FA.first_appearance
       AND C.reg_date <= FORMAT_DATE('%Y%m%d', LEAST(
-        DATE_ADD(PARSE_DATE('%Y%m%d', FA.first_appearance), INTERVAL {conv_window} DAY),
-        PARSE_DATE('%Y%m%d', '{day_end}')
+        DATE_ADD(PARSE_DATE('%Y%m%d', FA.first_appearance), INTERVAL @conv_window DAY),
+        PARSE_DATE('%Y%m%d', @day_end)
       ))
   ),
   TestSessionCounts AS (
@@ -110,13 +114,13 @@ WITH
     INNER JOIN UserFirstAppearance AS FA
       ON U.user = FA.user
     WHERE
-      U._TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+      U._TABLE_SUFFIX BETWEEN @day_start AND @day_end
       AND E.event_name = 'session_start'
-      AND E.app_info.id = '{app_id}'
+      AND E.app_info.id = @app_id
       AND E.event_date >= FA.first_appearance
       AND E.event_date <= FORMAT_DATE('%Y%m%d', LEAST(
-        DATE_ADD(PARSE_DATE('%Y%m%d', FA.first_appearance), INTERVAL {conv_window} DAY),
-        PARSE_DATE('%Y%m%d', '{day_end}')
+        DATE_ADD(PARSE_DATE('%Y%m%d', FA.first_appearance), INTERVAL @conv_window DAY),
+        PARSE_DATE('%Y%m%d', @day_end)
       ))
     GROUP BY 1
   ),
@@ -130,18 +134,18 @@ WITH
     INNER JOIN UserFirstAppearance AS FA
       ON U.user = FA.user
     WHERE
-      U._TABLE_SUFFIX BETWEEN '{day_start}' AND '{day_end}'
+      U._TABLE_SUFFIX BETWEEN @day_start AND @day_end
       AND E.event_name = 'session_start'
-      AND E.app_info.id = '{app_id}'
+      AND E.app_info.id = @app_id
       AND E.event_date >= FA.first_appearance
       AND E.event_date <= FORMAT_DATE('%Y%m%d', LEAST(
-        DATE_ADD(PARSE_DATE('%Y%m%d', FA.first_appearance), INTERVAL {conv_window} DAY),
-        PARSE_DATE('%Y%m%d', '{day_end}')
+        DATE_ADD(PARSE_DATE('%Y%m%d', FA.first_appearance), INTERVAL @conv_window DAY),
+        PARSE_DATE('%Y%m%d', @day_end)
       ))
     GROUP BY 1
   ),
   Dates AS (
-    SELECT GENERATE_DATE_ARRAY('{date_start}', '{date_end}', INTERVAL 1 DAY) AS date_array
+    SELECT GENERATE_DATE_ARRAY(PARSE_DATE('%Y%m%d', @day_start), PARSE_DATE('%Y%m%d', @day_end), INTERVAL 1 DAY) AS date_array
   ),
   DatesFormatted AS (
     SELECT
@@ -15,6 +15,7 @@
 
 from typing import Any, Callable
 import json
+import logging
 import os
 import math
 import yaml
@@ -577,7 +578,8 @@ def process():
   # TODO: wrap in try--catch to send any error to email
   context.data_gateway.ensure_users_normalized(context.target)
   audiences = context.data_gateway.get_audiences(context.target)
-  audiences_log = context.data_gateway.get_audiences_log(context.target)
+  audiences_log = context.data_gateway.get_audiences_log(
+      context.target, audience_name=audience_name)
   update_customer_match_mappings(context, audiences)
   result = {}
   log = []
@@ -744,7 +746,8 @@ def update_customer_match_audiences():
   audience_name = request.args.get('audience') or params.get('audience')
   mode = request.args.get('mode') or params.get('mode')
   audiences = context.data_gateway.get_audiences(context.target)
-  audiences_log = context.data_gateway.get_audiences_log(context.target)
+  audiences_log = context.data_gateway.get_audiences_log(
+      context.target, audience_name=audience_name)
   update_customer_match_mappings(context, audiences)
   # upload audiences users to Google Ads as customer match user lists
   logger.debug(
@@ -795,7 +798,7 @@ def get_audiences_status():
     jobs_status = context.ads_gateway.get_userlist_jobs_status(user_lists)
     user_lists_names = [i.name for i in audiences if i.user_list]
     campaigns = context.ads_gateway.get_userlist_campaigns(user_lists_names)
-  if logger.isEnabledFor(logger.level):
+  if logger.isEnabledFor(logging.DEBUG):
     logger.debug('Loaded %s offline jobs, showing first 20:', len(jobs_status))
     logger.debug(jobs_status[:20])
   # resource_name, status, failure_reason, user_list
@@ -0,0 +1,452 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+from datetime import date, datetime, timezone
+from unittest import mock
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from google.api_core import exceptions
+from google.cloud import bigquery
+import data_gateway
+from config import AppNotInitializedError, Config, ConfigTarget
+from data_gateway import DataGateway, QueryExecutionError
+from data_gateway import _inline_query_parameters
+from models import Audience, AudienceLog
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+  """Make sure cached results of other tests aren't used."""
+  data_gateway._GA4_STATS_CACHE.clear()
+  data_gateway._AUDIENCES_LOG_CACHE.clear()
+  data_gateway._AUDIENCES_CACHE.clear()
+  data_gateway.country_name_to_code_cache.clear()
+
+
+@pytest.fixture
+def target() -> ConfigTarget:
+  target = ConfigTarget()
+  target.name = 'test'
+  target.bq_dataset_id = 'remarque'
+  target.ga4_project = 'ga4_project'
+  target.ga4_dataset = 'analytics_1'
+  target.ga4_table = 'events'
+  return target
+
+
+@pytest.fixture
+def gateway() -> DataGateway:
+  """Create a gateway with a mocked BigQuery client."""
+  config = Config()
+  config.project_id = 'project'
+  gateway = DataGateway.__new__(DataGateway)
+  gateway.config = config
+  gateway.bq_client = mock.MagicMock()
+  gateway.credentials = None
+  gateway._bq_storage_client = None
+  gateway._segment_tables_cache = {}
+  return gateway
+
+
+def _make_audience(name: str, **kwargs) -> Audience:
+  return Audience.from_dict({'name': name, 'app_id': 'app', **kwargs})
+
+
+def _make_log(name: str, day: datetime) -> AudienceLog:
+  return AudienceLog(
+      name=name,
+      date=day,
+      job_resource_name='',
+      uploaded_user_count=10,
+      new_test_user_count=10,
+      new_control_user_count=10,
+      test_user_count=10,
+      control_user_count=10,
+      total_test_user_count=10,
+      total_control_user_count=10,
+      failed_user_count=0)
+
+
+def test_update_audiences_log_mixed_dates(gateway: DataGateway,
+                                          target: ConfigTarget):
+  """Test saving log with tz-aware (from BigQuery) and naive entries."""
+  logs = [
+      _make_log('a1', datetime(2024, 5, 1, tzinfo=timezone.utc)),
+      _make_log('a1', datetime(2024, 5, 2)),
+      _make_log('a1', None),
+  ]
+
+  gateway.update_audiences_log(target, logs)
+
+  gateway.bq_client.load_table_from_dataframe.assert_called_once()
+  df = gateway.bq_client.load_table_from_dataframe.call_args.args[0]
+  assert isinstance(df['date'].dtype, pd.DatetimeTZDtype)
+  assert df['date'][0] == pd.Timestamp('2024-05-01', tz='UTC')
+  assert df['date'][1] == pd.Timestamp('2024-05-02', tz='UTC')
+  assert not df['date'].isna().any()
+
+
+def _make_audiences_mock(*names: str) -> list[mock.MagicMock]:
+  audiences = []
+  for name in names:
+    audience = mock.MagicMock()
+    audience.name = name
+    audiences.append(audience)
+  return audiences
+
+
+def test_rebuilt_audiences_log_replaces_only_audience(gateway: DataGateway,
+                                                      target: ConfigTarget):
+  """Test rebuilding log for one audience replaces only its entries."""
+  audiences = _make_audiences_mock('a1', 'a2')
+  new_log = [_make_log('a1', datetime(2024, 5, 1, tzinfo=timezone.utc))]
+  with mock.patch.object(gateway, 'get_audiences', return_value=audiences), \
+      mock.patch.object(gateway, '_load_audiences_log',
+                        return_value={}) as load_log, \
+      mock.patch.object(gateway, '_recalculate_audience_log',
+                        return_value=new_log) as recalculate:
+    result = gateway.rebuilt_audiences_log(target, 'a1')
+
+  assert result == {'a1': new_log}
+  load_log.assert_called_once()
+  recalculate.assert_called_once_with(target, audiences[0], None)
+  # new entries are loaded into a staging table
+  load_call = gateway.bq_client.load_table_from_dataframe.call_args
+  table_name_new = load_call.args[1]
+  assert table_name_new.startswith('remarque.audiences_log_rebuild_')
+  assert list(load_call.args[0]['name']) == ['a1']
+  # and swapped with old ones in one transaction
+  query = gateway.bq_client.query.call_args.args[0]
+  assert query.startswith('BEGIN TRANSACTION;')
+  assert 'DELETE FROM `remarque.audiences_log` WHERE name = @name;' in query
+  assert (f'INSERT INTO `remarque.audiences_log` '
+          f'SELECT * FROM `{table_name_new}`;') in query
+  assert query.endswith('COMMIT TRANSACTION;')
+  job_config = gateway.bq_client.query.call_args.kwargs['job_config']
+  assert job_config.query_parameters[0].value == 'a1'
+  gateway.bq_client.delete_table.assert_called_once_with(
+      table_name_new, not_found_ok=True)
+
+
+def test_rebuilt_audiences_log_failed_load(gateway: DataGateway,
+                                           target: ConfigTarget):
+  """Test audience's entries are kept if new ones failed to load."""
+  new_log = [_make_log('a1', datetime(2024, 5, 1, tzinfo=timezone.utc))]
+  gateway.bq_client.load_table_from_dataframe.side_effect = (
+      exceptions.BadRequest('error'))
+  with mock.patch.object(gateway, 'get_audiences',
+                         return_value=_make_audiences_mock('a1')), \
+      mock.patch.object(gateway, '_load_audiences_log', return_value={}), \
+      mock.patch.object(gateway, '_recalculate_audience_log',
+                        return_value=new_log):
+    with pytest.raises(exceptions.BadRequest):
+      gateway.rebuilt_audiences_log(target, 'a1')
+
+  gateway.bq_client.query.assert_not_called()
+
+
+def test_rebuilt_audiences_log_all(gateway: DataGateway, target: ConfigTarget):
+  """Test rebuilding log for all audiences rewrites it with one load job."""
+  new_logs = {
+      'a1': [_make_log('a1', datetime(2024, 5, 1, tzinfo=timezone.utc))],
+      'a2': [_make_log('a2', datetime(2024, 5, 2, tzinfo=timezone.utc))],
+  }
+  with mock.patch.object(gateway, 'get_audiences',
+                         return_value=_make_audiences_mock('a1', 'a2')), \
+      mock.patch.object(gateway, '_load_audiences_log', return_value={}), \
+      mock.patch.object(gateway, '_recalculate_audience_log',
+                        side_effect=lambda t, a, e: new_logs[a.name]):
+    result = gateway.rebuilt_audiences_log(target, None)
+
+  assert result == new_logs
+  gateway.bq_client.query.assert_not_called()
+  load_call = gateway.bq_client.load_table_from_dataframe.call_args
+  assert list(load_call.args[0]['name']) == ['a1', 'a2']
+  job_config = load_call.kwargs['job_config']
+  assert job_config.write_disposition == 'WRITE_TRUNCATE'
+  # the load recreates the table, so its spec is kept
+  assert job_config.time_partitioning.field == 'date'
+  assert job_config.clustering_fields == ['name']
+
+
+def test_query_to_arrow_batches_errors(gateway: DataGateway):
+  """Test query errors are mapped the same way as in execute_query."""
+  query_job = gateway.bq_client.query.return_value
+  query_job.query = 'SELECT foo FROM t'
+  query_job.result.side_effect = exceptions.BadRequest(
+      'error',
+      errors=[{
+          'reason': 'invalidQuery',
+          'message': 'Unrecognized name: foo'
+      }])
+  with pytest.raises(AppNotInitializedError):
+    gateway._query_to_arrow_batches('SELECT foo FROM t')
+
+  query_job.result.side_effect = exceptions.BadRequest(
+      'error', errors=[{
+          'reason': 'invalid',
+          'message': 'Syntax error'
+      }])
+  with pytest.raises(QueryExecutionError):
+    gateway._query_to_arrow_batches('SELECT foo FROM t')
+
+
+def test_update_audiences(gateway: DataGateway, target: ConfigTarget):
+  """Test audiences are merged in one statement and removed ones deleted."""
+  audiences_old = [_make_audience('a1'), _make_audience('a2')]
+  audiences = [
+      _make_audience('a1', countries=['US'], events_include=['purchase']),
+      _make_audience('a3')
+  ]
+  with mock.patch.object(gateway, 'get_audiences',
+                         return_value=audiences_old), \
+      mock.patch.object(gateway, '_on_audience_removed') as on_removed:
+    result = gateway.update_audiences(target, audiences)
+
+  assert result == {'deleted': ['a2']}
+  assert gateway.bq_client.query.call_count == 2
+  # all audiences are upserted with one MERGE over an ARRAY<STRUCT> param
+  merge_call, delete_call = gateway.bq_client.query.call_args_list
+  query = merge_call.args[0]
+  assert 'MERGE `remarque.audiences` t' in query
+  assert 'USING UNNEST(@rows) s' in query
+  params = merge_call.kwargs['job_config'].query_parameters
+  assert len(params) == 1
+  # check the parameter as it's sent to BigQuery
+  param = params[0].to_api_repr()
+  assert param['name'] == 'rows'
+  assert param['parameterType']['arrayType']['type'] == 'STRUCT'
+  struct_types = {
+      i['name']: i['type']
+      for i in param['parameterType']['arrayType']['structTypes']
+  }
+  assert struct_types['countries'] == {
+      'type': 'ARRAY',
+      'arrayType': {
+          'type': 'STRING'
+      }
+  }
+  assert struct_types['ttl'] == {'type': 'INT64'}
+  rows = {
+      i['structValues']['name']['value']: i['structValues']
+      for i in param['parameterValue']['arrayValues']
+  }
+  assert set(rows) == {'a1', 'a3'}
+  assert rows['a1']['countries'] == {'arrayValues': [{'value': 'US'}]}
+  assert rows['a1']['events_include'] == {
+      'arrayValues': [{
+          'value': 'purchase'
+      }]
+  }
+  assert rows['a1']['table_name'] == {'value': 'audience_a1'}
+  assert rows['a3']['ttl'] == {'value': '1'}
+  # removed audiences are deleted with one statement
+  assert delete_call.args[0] == (
+      'DELETE FROM `remarque.audiences` WHERE name IN UNNEST(@names)')
+  params = delete_call.kwargs['job_config'].query_parameters
+  assert params[0].name == 'names'
+  assert params[0].values == ['a2']
+  gateway.bq_client.query.return_value.result.assert_called()
+  on_removed.assert_called_once_with(target, audiences_old[1])
+
+
+def test_update_audiences_nothing_to_delete(gateway: DataGateway,
+                                            target: ConfigTarget):
+  """Test no DELETE is issued if no audience was removed."""
+  with mock.patch.object(gateway, 'get_audiences',
+                         return_value=[_make_audience('a1')]), \
+      mock.patch.object(gateway, '_on_audience_removed') as on_removed:
+    result = gateway.update_audiences(target, [_make_audience('a1')])
+
+  assert result == {'deleted': []}
+  gateway.bq_client.query.assert_called_once()
+  assert 'MERGE' in gateway.bq_client.query.call_args.args[0]
+  on_removed.assert_not_called()
+
+
+def test_get_ga4_stats(gateway: DataGateway, target: ConfigTarget):
+  """Test rows of the grouping sets query are split into events/countries."""
+  rows = [
+      {
+          'app_id': 'app1',
+          'event': 'purchase',
+          'country': None,
+          'is_event': True,
+          'count': 30
+      },
+      {
+          'app_id': 'app1',
+          'event': None,
+          'country': 'United States',
+          'is_event': False,
+          'count': 20
+      },
+      {
+          'app_id': 'app1',
+          'event': 'first_open',
+          'country': None,
+          'is_event': True,
+          'count': 10
+      },
+      {
+          'app_id': 'app2',
+          'event': None,
+          'country': 'Germany',
+          'is_event': False,
+          'count': 5
+      },
+  ]
+  codes = {'United States': 'US', 'Germany': 'DE'}
+  with mock.patch.object(gateway, 'execute_query',
+                         return_value=rows) as execute_query, \
+      mock.patch.object(data_gateway, '_get_country_codes_by_name',
+                        return_value=codes):
+    result = gateway.get_ga4_stats(target, 10, 1)
+    # the second call is served from the cache
+    cached = gateway.get_ga4_stats(target, 10, 1)
+    assert cached == result
+    # callers get copies, so changes don't leak into the cache
+    cached['events']['app1'].clear()
+    assert gateway.get_ga4_stats(target, 10, 1) == result
+
+  execute_query.assert_called_once()
+  query = execute_query.call_args.args[0]
+  assert '`ga4_project.analytics_1.events_*`' in query
+  assert 'GROUPING SETS' in query
+  params = execute_query.call_args.kwargs['job_config'].query_parameters
+  assert [p.name for p in params] == ['day_start', 'day_end']
+  assert result['app_ids'] == ['app1']
+  assert result['events'] == {
+      'app1': [{
+          'app_id': 'app1',
+          'event': 'purchase',
+          'count': 30
+      }, {
+          'app_id': 'app1',
+          'event': 'first_open',
+          'count': 10
+      }]
+  }
+  assert result['countries'] == {
+      'app1': [{
+          'app_id': 'app1',
+          'country': 'United States',
+          'country_code': 'US',
+          'count': 20
+      }],
+      'app2': [{
+          'app_id': 'app2',
+          'country': 'Germany',
+          'country_code': 'DE',
+          'count': 5
+      }]
+  }
+
+
+def test_inline_query_parameters():
+  """Test parameters values are inlined as escaped SQL literals."""
+  query = """WHERE app_id = @app_id
+  AND event IN UNNEST(@events)
+  AND day BETWEEN @day_start AND @day_end
+  AND ts < @ts
+  AND n = @conv_window
+  AND x = @unknown"""
+  params = [
+      bigquery.ScalarQueryParameter('app_id', 'STRING', "it's\\ @day_end"),
+      bigquery.ArrayQueryParameter('events', 'STRING',
+                                   ['purchase', "o'rder", 'new\nline']),
+      bigquery.ScalarQueryParameter('day_start', 'DATE', date(2024, 5, 1)),
+      bigquery.ScalarQueryParameter('day_end', 'STRING', None),
+      bigquery.ScalarQueryParameter('ts', 'TIMESTAMP',
+                                    datetime(2024, 5, 2, 10, 30)),
+      bigquery.ScalarQueryParameter('conv_window', 'INT64', 14),
+  ]
+
+  result = _inline_query_parameters(query, params).split('\n')
+
+  # values are not substituted again (e.g. '@day_end' in a string)
+  assert result[0] == "WHERE app_id = 'it\\'s\\\\ @day_end'"
+  assert result[1] == (
+      "  AND event IN UNNEST(['purchase', 'o\\'rder', 'new\\nline'])")
+  assert result[2] == "  AND day BETWEEN DATE '2024-05-01' AND NULL"
+  assert result[3] == "  AND ts < TIMESTAMP '2024-05-02 10:30:00'"
+  assert result[4] == '  AND n = 14'
+  # unknown parameters are left as they are
+  assert result[5] == '  AND x = @unknown'
+
+
+def test_inline_query_parameters_date_array():
+  """Test dates in array parameters are inlined as DATE literals."""
+  params = [
+      bigquery.ArrayQueryParameter('days', 'DATE',
+                                   [date(2024, 5, 1),
+                                    date(2024, 5, 2)])
+  ]
+
+  result = _inline_query_parameters('SELECT @days', params)
+
+  assert result == "SELECT [DATE '2024-05-01', DATE '2024-05-02']"
+
+
+def test_update_audiences_log_invalidates_cache(gateway: DataGateway,
+                                                target: ConfigTarget):
+  """Test cached log of the dataset is reset when the log is updated."""
+  other_key = ('project', 'other_dataset', False, None)
+  data_gateway._AUDIENCES_LOG_CACHE[other_key] = {}
+  log = {'a1': [_make_log('a1', datetime(2024, 5, 1, tzinfo=timezone.utc))]}
+  with mock.patch.object(gateway, '_load_audiences_log',
+                         return_value=log) as load_log:
+    gateway.get_audiences_log(target)
+    gateway.get_audiences_log(target)
+    assert load_log.call_count == 1
+
+    gateway.update_audiences_log(target, log['a1'])
+    gateway.get_audiences_log(target)
+    assert load_log.call_count == 2
+
+    # the cache is reset even if the entries failed to save
+    gateway.bq_client.load_table_from_dataframe.side_effect = (
+        exceptions.BadRequest('error'))
+    with pytest.raises(ValueError):
+      gateway.update_audiences_log(target, log['a1'])
+    gateway.get_audiences_log(target)
+    assert load_log.call_count == 3
+  # logs of other datasets are kept
+  assert other_key in data_gateway._AUDIENCES_LOG_CACHE
+
+
+def test_update_audiences_invalidates_cache(gateway: DataGateway,
+                                            target: ConfigTarget):
+  """Test cached audiences of the dataset are reset when they are updated."""
+  audiences = [_make_audience('a1'), _make_audience('a2')]
+  with mock.patch.object(gateway, '_load_audiences',
+                         return_value=audiences) as load_audiences, \
+      mock.patch.object(gateway, '_on_audience_removed'):
+    gateway.get_audiences(target)
+    gateway.get_audiences(target)
+    assert load_audiences.call_count == 1
+
+    # update_audiences reads audiences itself (from the cache)
+    gateway.update_audiences(target, [_make_audience('a1')])
+    assert load_audiences.call_count == 1
+    gateway.get_audiences(target)
+    assert load_audiences.call_count == 2
+
+
+if __name__ == '__main__':
+  pytest.main([__file__])